@@ -1,17 +1,62 @@
-from flask import Flask, Response
+from flask import Flask, Response, request, send_file
 import glob
 import time
+import hashlib
+import json
+import zlib
+import tempfile
+from datetime import datetime, timezone, timedelta
+from functools import lru_cache
 from collections import defaultdict
+from xml.sax.saxutils import quoteattr
 from rapidfuzz import process, fuzz
+from itertools import islice
 from stream_checker import StreamChecker
+from normalizer import normalize_name, load_rules
 import threading
 import re
 import xml.etree.ElementTree as ET
 import os
 import logging
 from logging.handlers import RotatingFileHandler
-
+try:
+    import brotli
+except ImportError: # Only needed to offer Content-Encoding: br
+    brotli = None
+
+EPG_READ_CHUNK_SIZE = 64 * 1024  # bytes of guide.xml fed to the parser at a time
+EPG_FLUSH_SIZE = 64 * 1024  # characters of rewritten EPG buffered before each yield
+# Rewritten /epg.xml bodies (plus precompressed variants) are cached here, keyed by guide.xml mtime/size and the channel map
+EPG_CACHE_DIR = os.environ.get("EPG_CACHE_DIR", "cache/epg")
+EPG_CACHE_CHECK_INTERVAL = int(os.environ.get("EPG_CACHE_CHECK_INTERVAL", 60))  # seconds between guide.xml change checks
+# Pruning: only emit <channel>/<programme> elements whose tvg-id is in the current channel groups
+EPG_PRUNE = os.environ.get("EPG_PRUNE", "0") == "1"
+# Optional programme window around now (0 = unbounded on that side), e.g. 6 / 72 for now-6h..now+72h
+EPG_WINDOW_PAST_HOURS = int(os.environ.get("EPG_WINDOW_PAST_HOURS", 0))
+EPG_WINDOW_FUTURE_HOURS = int(os.environ.get("EPG_WINDOW_FUTURE_HOURS", 0))
+EPG_WINDOW_BUCKET = int(os.environ.get("EPG_WINDOW_BUCKET", 3600))  # seconds; the window (and cached EPG) moves in these steps
+# Precompressed variants of /playlist.m3u and /epg.xml, built once per content version, in server preference order
+# (unsupported names, and br without the brotli package, are dropped with a warning below)
+RESPONSE_ENCODINGS = [
+    encoding.strip().lower() for encoding in os.environ.get("RESPONSE_ENCODINGS", "br,gzip").split(",") if encoding.strip()
+]
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", 5))
+ENCODING_SUFFIXES = {"gzip": ".gz", "br": ".br"}
 FUZZY_MATCH_THRESHOLD = 70  # similarity threshold
+FUZZY_BATCH_SIZE = 1000  # M3U entries buffered per batch of fuzzy EPG matching
+# Fuzzy EPG match results persisted across reloads; entries are only reused while the EPG names/ids they were matched against are unchanged
+FUZZY_MATCH_CACHE_PATH = os.environ.get("FUZZY_MATCH_CACHE_PATH", "input/.fuzzy_match_cache.json")
+
+# "snapshot": /playlist.m3u renders from a background-refreshed snapshot of active streams.
+# "live": every request probes all streams before responding (previous behaviour).
+PLAYLIST_MODE = os.environ.get("PLAYLIST_MODE", "snapshot")
+SNAPSHOT_REFRESH_INTERVAL = int(os.environ.get("SNAPSHOT_REFRESH_INTERVAL", 120))  # seconds between background sweeps
+PLAYLIST_MAX_STALENESS = int(os.environ.get("PLAYLIST_MAX_STALENESS", 600))  # oldest snapshot served before refreshing inline
+# "sweep": check every group's current stream each MONITOR_INTERVAL seconds.
+# "scheduled": per-stream priority scheduling with backoff for stable streams.
+MONITOR_MODE = os.environ.get("MONITOR_MODE", "sweep")
+MONITOR_INTERVAL = int(os.environ.get("MONITOR_INTERVAL", 60))
 
 # Configure logging only once
 if not logging.getLogger().handlers:
@@ -33,122 +78,484 @@ if not logging.getLogger().handlers:
 
 logger = logging.getLogger(__name__)
 
+for _encoding in RESPONSE_ENCODINGS:
+    if _encoding not in ENCODING_SUFFIXES:
+        logger.warning(f"RESPONSE_ENCODINGS: unsupported encoding '{_encoding}' ignored (supported: {', '.join(ENCODING_SUFFIXES)}).")
+    elif _encoding == "br" and brotli is None:
+        logger.warning("RESPONSE_ENCODINGS: 'br' needs the brotli package, which is not installed; not offering it.")
+RESPONSE_ENCODINGS = [
+    encoding for encoding in RESPONSE_ENCODINGS if encoding in ENCODING_SUFFIXES and (encoding != "br" or brotli is not None)
+]
+
+# Pre-encoded /playlist.m3u body for the current StreamChecker snapshot version
+_playlist_cache = {"version": None, "body": b"", "variants": {}, "etag": "", "last_modified": None}
+_playlist_cache_lock = threading.Lock()
+
+# Rewritten EPG currently on disk, and the tvg-id -> canonical name map for the current channel config
+_epg_cache = {"key": None, "path": None, "variants": {}, "last_modified": None}
+_epg_cache_lock = threading.Lock()
+_epg_rebuilding = threading.Event()
+_epg_name_map = {"channels": None, "map": {}, "hash": ""}
+
+def make_compressor(encoding):
+    """Return (compress, finish) callables for incrementally encoding a body with encoding."""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31) # wbits=31: gzip container
+    return compressor.compress, compressor.flush
+
+def compress_variants(body):
+    """Encode body once per RESPONSE_ENCODINGS entry: {encoding: bytes}."""
+    variants = {}
+    for encoding in RESPONSE_ENCODINGS:
+        compress, finish = make_compressor(encoding)
+        variants[encoding] = compress(body) + finish()
+    return variants
+
+def negotiate_encoding(available):
+    """Pick the precompressed variant the client prefers from Accept-Encoding, or None for identity."""
+    if not available:
+        return None
+    best = request.accept_encodings.best_match(list(available) + ["identity"], default="identity")
+    return None if best == "identity" else best
+
 def auto_reload_m3u(interval=172800):  # Default: every 48 hours
     while True:
         time.sleep(interval)
         logger.info("Attempting to reload M3U playlist and EPG data...")
+        load_rules() # Pick up edits to the name normalization rule file
         new_entries = parse_m3u_files("input/")
         new_grouped_channels = group_channels(new_entries)
         checker.update_config({"channels": new_grouped_channels}) # Pass the correct structure
         logger.info("M3U playlist and EPG data reloaded, checker updated.")
 
-def normalize_name(name):
-    """Normalize channel names by removing resolution tags, region suffixes, punctuation, and excess spaces."""
-    name = name.lower()
-    name = re.sub(r'\s*\(.*?\)|\[.*?\]', '', name)  # Remove content within parentheses or brackets
-    name = re.sub(r'\b(hd|fhd|uhd|4k|sd|uk|us|ca|au|de|pt|fr)\d*\b', '', name) # Now handles tags like hd1, hd2
-    name = re.sub(r'^(uk:|us:|ca:|pt:|es:|tr:|lb:)', '', name)
-    name = re.sub(r'[^\w\s]', '', name)  # Remove punctuation
-    name = re.sub(r'\s+', ' ', name).strip()
-
-    # Iteratively remove trailing numbers if they appear to be stream indices
-    # following another number. e.g., "channel name 1 2" -> "channel name 1".
-    # This handles cases like "bt sport 1 1" -> "bt sport 1".
-    previous_name_state = None
-    while name != previous_name_state:
-        previous_name_state = name
-        # Regex: Matches a string ending with "<text><space><digits><space><digits>"
-        # and replaces it with "<text><space><digits>"
-        name = re.sub(r'^(.*\s\d+)\s\d+$', r'\1', name)
-    return name
-
 def load_epg_map(epg_path="input/guide.xml"):
-    """Create mapping from EPG data: {normalized_display_name: tvg-id}"""
+    """
+    Create mapping from EPG data: {normalized_display_name: tvg-id}
+    The guide is scanned incrementally: each <channel> is discarded once read, and the scan
+    stops at the first <programme> since XMLTV lists all channels before any programmes.
+    """
     epg_map = {}
     try:
-        tree = ET.parse(epg_path)
-        for channel_node in tree.findall(".//channel"):
-            tvg_id = channel_node.get("id")
-            if not tvg_id:
-                continue
-            for name_node in channel_node.findall("display-name"):
-                if name_node.text:
-                    original_epg_name = name_node.text.strip()
-                    normalized_epg_name = normalize_name(original_epg_name)
-                    if normalized_epg_name not in epg_map: # First one wins in case of normalization collision
-                        epg_map[normalized_epg_name] = tvg_id
-                    else:
-                        logger.warning(
-                            f"EPG name collision: '{original_epg_name}' and other(s) normalize to "
-                            f"'{normalized_epg_name}' (tvg-id: {tvg_id}). "
-                            f"Keeping tvg-id '{epg_map[normalized_epg_name]}' from first encountered EPG entry."
-                        )
+        with open(epg_path, "rb") as f:
+            context = ET.iterparse(f, events=("start", "end"))
+            _, root = next(context) # <tv>
+            for event, node in context:
+                if event == "start":
+                    if node.tag == "programme":
+                        break # Channel block is over; don't read the programme data
+                    continue
+                if node.tag != "channel":
+                    continue
+                tvg_id = node.get("id")
+                if tvg_id:
+                    for name_node in node.findall("display-name"):
+                        if name_node.text:
+                            original_epg_name = name_node.text.strip()
+                            normalized_epg_name = normalize_name(original_epg_name)
+                            if normalized_epg_name not in epg_map: # First one wins in case of normalization collision
+                                epg_map[normalized_epg_name] = tvg_id
+                            else:
+                                logger.warning(
+                                    f"EPG name collision: '{original_epg_name}' and other(s) normalize to "
+                                    f"'{normalized_epg_name}' (tvg-id: {tvg_id}). "
+                                    f"Keeping tvg-id '{epg_map[normalized_epg_name]}' from first encountered EPG entry."
+                                )
+                root.clear() # Drop channels already read so memory stays flat
         logger.info(f"Loaded {len(epg_map)} EPG mappings (using normalized display names).")
     except Exception as e:
         logger.error(f"EPG parsing error: {e}")
     return epg_map
 
-def parse_m3u_files(m3u_folder="input/"):
-    channel_entries = []
-    # epg_map is now {normalized_epg_display_name: tvg_id}
-    epg_map = load_epg_map()
-    normalized_epg_names_for_fuzz = list(epg_map.keys())
+@lru_cache(maxsize=4096)
+def parse_xmltv_time(value):
+    """Parse an XMLTV timestamp ("%Y%m%d%H%M%S %z", offset optional) to an aware datetime, or None."""
+    try:
+        return datetime.strptime(value.strip(), "%Y%m%d%H%M%S %z")
+    except ValueError:
+        try:
+            return datetime.strptime(value.strip()[:14], "%Y%m%d%H%M%S").replace(tzinfo=timezone.utc)
+        except ValueError:
+            return None
+
+def epg_window(now=None):
+    """(start, end) programme window for the current EPG_WINDOW_BUCKET, or None when no window is configured."""
+    if not (EPG_WINDOW_PAST_HOURS or EPG_WINDOW_FUTURE_HOURS):
+        return None
+    now = time.time() if now is None else now
+    anchor = datetime.fromtimestamp(now - now % EPG_WINDOW_BUCKET, tz=timezone.utc) # Stable within a bucket
+    start = anchor - timedelta(hours=EPG_WINDOW_PAST_HOURS) if EPG_WINDOW_PAST_HOURS else None
+    end = anchor + timedelta(hours=EPG_WINDOW_FUTURE_HOURS + EPG_WINDOW_BUCKET / 3600) if EPG_WINDOW_FUTURE_HOURS else None
+    return start, end
+
+def programme_in_window(node, window):
+    """True if the <programme> overlaps window; programmes with unparseable times are kept."""
+    start_time = parse_xmltv_time(node.get("start", ""))
+    if start_time is None:
+        return True
+    stop_time = parse_xmltv_time(node.get("stop", "")) or start_time
+    window_start, window_end = window
+    if window_start is not None and stop_time < window_start:
+        return False
+    if window_end is not None and start_time > window_end:
+        return False
+    return True
+
+def iter_modified_epg(epg_file, tvg_id_to_canonical_name_map, keep_ids=None, window=None):
+    """
+    Stream a rewritten copy of an open XMLTV guide, replacing <display-name> of mapped channels.
+    Each top-level element is serialized and discarded as soon as it is complete, so memory
+    use is bounded by the largest single <channel>/<programme> rather than the whole guide.
+    Parse errors propagate so a broken guide never ends up as a truncated cached copy.
+    If keep_ids is given, only channels/programmes for those tvg-ids are emitted; if window is
+    given, programmes outside (start, end) are dropped.
+    """
+    try:
+        parser = ET.XMLPullParser(events=("start", "end"))
+        root = None
+        depth = 0
+        out = ["<?xml version='1.0' encoding='utf-8'?>\n"]
+        size = 0
+        for data in iter(lambda: epg_file.read(EPG_READ_CHUNK_SIZE), b""):
+            parser.feed(data)
+            for event, node in parser.read_events():
+                if event == "start":
+                    depth += 1
+                    if depth == 1:
+                        root = node
+                        attrs = "".join(f" {k}={quoteattr(v)}" for k, v in node.attrib.items())
+                        out.append(f"<{node.tag}{attrs}>\n")
+                    continue
+                depth -= 1
+                if depth != 1:
+                    continue
+                if node.tag == "channel":
+                    tvg_id = node.get("id")
+                    if keep_ids is not None and tvg_id not in keep_ids:
+                        root.remove(node)
+                        continue
+                    if tvg_id in tvg_id_to_canonical_name_map:
+                        for display_name_node in node.findall("display-name"):
+                            display_name_node.text = tvg_id_to_canonical_name_map[tvg_id]
+                elif node.tag == "programme":
+                    if (keep_ids is not None and node.get("channel") not in keep_ids) or \
+                            (window is not None and not programme_in_window(node, window)):
+                        root.remove(node)
+                        continue
+                node.tail = "\n"
+                chunk = ET.tostring(node, encoding="unicode")
+                root.remove(node) # Already written out
+                out.append(chunk)
+                size += len(chunk)
+                if size >= EPG_FLUSH_SIZE:
+                    yield "".join(out)
+                    out, size = [], 0
+        parser.close()
+        if root is not None:
+            out.append(f"</{root.tag}>\n")
+        yield "".join(out)
+    finally:
+        epg_file.close()
+
+def build_epg_name_map(grouped_channels):
+    """Map tvg-id -> canonical name for the channel groups, plus a hash of the mapping."""
+    tvg_id_to_canonical_name_map = {}
+    for entries_list in grouped_channels.values():
+        for entry in entries_list:
+            if 'tvg-id' in entry and 'canonical_name' in entry:
+                # If multiple groups somehow map to the same tvg-id, last one wins.
+                tvg_id_to_canonical_name_map[entry['tvg-id']] = entry['canonical_name']
+    map_hash = hashlib.sha1(json.dumps(sorted(tvg_id_to_canonical_name_map.items())).encode("utf-8")).hexdigest()
+    return tvg_id_to_canonical_name_map, map_hash
+
+def current_epg_name_map():
+    """Return (map, hash) for the checker's current channels, rebuilding only after a config change."""
+    channels = checker.config.get("channels", {}) if checker.config else {}
+    with _epg_cache_lock:
+        if _epg_name_map["channels"] is not channels: # update_config swaps in a new dict
+            name_map, map_hash = build_epg_name_map(channels)
+            _epg_name_map.update({"channels": channels, "map": name_map, "hash": map_hash})
+        return _epg_name_map["map"], _epg_name_map["hash"]
+
+def epg_cache_key(epg_path, map_hash, window=None):
+    """Cache key for the rewritten EPG: changes whenever guide.xml, the channel map, prune settings or window do."""
+    st = os.stat(epg_path)
+    window_part = "-".join(t.isoformat() if t else "" for t in window) if window else ""
+    raw = f"{st.st_mtime_ns}:{st.st_size}:{map_hash}:{EPG_PRUNE}:{window_part}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+def build_epg_cache(epg_path, key, tvg_id_to_canonical_name_map, window=None):
+    """Write the rewritten EPG (plus one precompressed copy per RESPONSE_ENCODINGS) for key to EPG_CACHE_DIR."""
+    os.makedirs(EPG_CACHE_DIR, exist_ok=True)
+    path = os.path.abspath(os.path.join(EPG_CACHE_DIR, f"epg-{key}.xml")) # send_file resolves relative paths against the app root
+    variants = {encoding: path + ENCODING_SUFFIXES[encoding] for encoding in RESPONSE_ENCODINGS}
+    if not all(os.path.exists(p) for p in [path, *variants.values()]): # Survives restarts
+        start = time.time()
+        # Unique temp files per build, so concurrent builds of the same key never share a file
+        # (the "epg-*" cleanup below doesn't match them either)
+        outputs = [] # (final_path, tmp_path, file, compress, finish)
+        try:
+            for target, encoding in [(path, None), *((p, e) for e, p in variants.items())]:
+                fd, tmp_path = tempfile.mkstemp(dir=EPG_CACHE_DIR, prefix=".build-", suffix=".tmp")
+                outputs.append((target, tmp_path, os.fdopen(fd, "wb"), *(make_compressor(encoding) if encoding else (None, None))))
+            keep_ids = set(tvg_id_to_canonical_name_map) if EPG_PRUNE else None
+            for chunk in iter_modified_epg(open(epg_path, "rb"), tvg_id_to_canonical_name_map, keep_ids, window):
+                data = chunk.encode("utf-8")
+                for _, _, out, compress, _ in outputs:
+                    out.write(compress(data) if compress else data)
+            for _, _, out, _, finish in outputs:
+                if finish:
+                    out.write(finish())
+                out.close()
+            for target, tmp_path, _, _, _ in outputs:
+                os.replace(tmp_path, target)
+        except Exception:
+            for _, tmp_path, out, _, _ in outputs:
+                out.close()
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            raise
+        logger.info(f"Built EPG cache {path} ({', '.join(['identity', *variants])}) in {time.time() - start:.1f}s")
+
+    with _epg_cache_lock:
+        _epg_cache.update({
+            "key": key,
+            "path": path,
+            "variants": variants,
+            "last_modified": datetime.fromtimestamp(os.path.getmtime(path), tz=timezone.utc),
+        })
+
+    # Drop cache files left over from previous guides / channel maps
+    for old_path in glob.glob(os.path.join(EPG_CACHE_DIR, "epg-*")):
+        if not os.path.basename(old_path).startswith(f"epg-{key}."):
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+def refresh_epg_cache(epg_path="input/guide.xml"):
+    """Start a background rebuild of the EPG cache if its inputs changed. Returns the current key."""
+    tvg_id_to_canonical_name_map, map_hash = current_epg_name_map()
+    window = epg_window()
+    key = epg_cache_key(epg_path, map_hash, window)
+    with _epg_cache_lock:
+        if _epg_cache["key"] == key or _epg_rebuilding.is_set():
+            return key
+        _epg_rebuilding.set()
+
+    def rebuild():
+        try:
+            build_epg_cache(epg_path, key, tvg_id_to_canonical_name_map, window)
+        except Exception as e:
+            logger.error(f"EPG cache build error: {e}")
+        finally:
+            _epg_rebuilding.clear()
+
+    threading.Thread(target=rebuild, daemon=True).start()
+    return key
+
+def epg_cache_refresher(interval=EPG_CACHE_CHECK_INTERVAL, epg_path="input/guide.xml"):
+    """Rebuild the cached EPG in the background whenever guide.xml, the channel config or the window bucket changes."""
+    while True:
+        try:
+            refresh_epg_cache(epg_path)
+        except Exception as e:
+            logger.error(f"EPG cache refresh error: {e}")
+        time.sleep(interval)
 
+EXTINF_RE = re.compile(r'#EXTINF:-1\s+(.*?)\s*,\s*(.*)')
+EXTINF_ATTR_RE = re.compile(r'(\w+?)="(.*?)"')
+
+def iter_m3u_lines(m3u_path):
+    """Lazily yield stripped, non-empty lines of an M3U file."""
+    with open(m3u_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+def iter_m3u_entries(lines):
+    """
+    Yield one attribute dict (#EXTINF attributes, display_name, url) per M3U entry.
+    Directives between #EXTINF and its URL (#EXTVLCOPT, #EXTGRP, ...) are skipped;
+    #EXTGRP supplies group-title when the #EXTINF line has none.
+    """
+    attrs = None # Entry waiting for its URL
+    for line in lines:
+        if line.startswith("#EXTINF"):
+            attrs = {}
+            match = EXTINF_RE.search(line)
+            if match:
+                attr_str, display_name = match.groups()
+                for attr_match in EXTINF_ATTR_RE.finditer(attr_str):
+                    key, value = attr_match.groups()
+                    attrs[key] = value
+                attrs['display_name'] = display_name.strip() # Original M3U display name
+        elif line.startswith("#"):
+            if attrs is not None and line.startswith("#EXTGRP:") and not attrs.get('group-title'):
+                attrs['group-title'] = line[len("#EXTGRP:"):].strip()
+        elif attrs is not None:
+            attrs['url'] = line
+            yield attrs
+            attrs = None
+
+class EpgMatcher:
+    """
+    Fuzzy matcher from normalized M3U names to normalized EPG names that only scores plausible
+    candidates: EPG names sharing with the query a distinctive word, the first 4 characters
+    ignoring spaces (so "skysports" still meets "sky sports"), the first 3 letters of a word
+    (so "nat geo" meets "national geographic"), or the first 2 letters of a word plus the first
+    character of the next (so "ch 4" meets "channel 4"). Numbers and word/prefix keys found in
+    more than 1% of the guide are not indexed, since they would make nearly everything a candidate.
+    """
+
+    def __init__(self, epg_names, score_cutoff):
+        self.names = list(epg_names)
+        self.score_cutoff = score_cutoff
+        self.index = defaultdict(list) # block key -> [index into self.names], ascending
+        for i, name in enumerate(self.names):
+            for key in self._block_keys(name):
+                self.index[key].append(i)
+        max_postings = max(100, len(self.names) // 100)
+        for key in [key for key, postings in self.index.items() if not key.startswith("p:") and len(postings) > max_postings]:
+            del self.index[key]
+
+    @staticmethod
+    def _block_keys(name):
+        tokens = name.split()
+        keys = {f"t:{token}" for token in tokens if len(token) > 1 and not token.isdigit()}
+        # Abbreviation keys: an abbreviated word keeps the start of the word it stands for
+        keys.update(f"w:{token[:3]}" for token in tokens if len(token) > 2 and not token.isdigit())
+        keys.update(f"b:{first[:2]}{second[0]}" for first, second in zip(tokens, tokens[1:]) if len(first) > 1 and not first.isdigit())
+        compact = name.replace(" ", "")
+        if compact:
+            keys.add(f"p:{compact[:4]}")
+        return keys
+
+    def candidates(self, name):
+        """Indexes of EPG names worth scoring against name, in EPG order (matching extractOne tie-breaking)."""
+        found = set()
+        for key in self._block_keys(name):
+            found.update(self.index.get(key, ()))
+        return sorted(found)
+
+    def match_many(self, queries):
+        """Returns {query: (epg_name, score) or None} with the best candidate scoring at least score_cutoff."""
+        results = {}
+        for query in queries:
+            candidate_indexes = self.candidates(query)
+            match_result = None
+            if candidate_indexes:
+                match_result = process.extractOne(
+                    query,
+                    [self.names[i] for i in candidate_indexes],
+                    scorer=fuzz.WRatio,
+                    score_cutoff=self.score_cutoff
+                )
+            results[query] = (match_result[0], match_result[1]) if match_result else None
+        return results
+
+def epg_content_hash(epg_map):
+    """Fingerprint of everything a fuzzy match result depends on: the EPG names/ids and the threshold."""
+    payload = json.dumps([FUZZY_MATCH_THRESHOLD, sorted(epg_map.items())], ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+def load_fuzzy_match_cache(epg_hash, cache_path=FUZZY_MATCH_CACHE_PATH):
+    """Returns {normalized M3U name: (epg_name, score) or None} for cached matches made against this EPG."""
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable fuzzy match cache {cache_path}: {e}")
+        return {}
+    matches = {}
+    for name, match in cached.get("matches", {}).items():
+        if match.get("epg_hash") == epg_hash:
+            matches[name] = (match["epg_name"], match["score"]) if match.get("epg_name") is not None else None
+    logger.info(f"Loaded {len(matches)} cached fuzzy EPG match(es) from {cache_path}.")
+    return matches
+
+def save_fuzzy_match_cache(epg_hash, epg_map, fuzzy_matches, cache_path=FUZZY_MATCH_CACHE_PATH):
+    """Persist fuzzy match results (including misses) for the current EPG, replacing the file atomically."""
+    matches = {}
+    for name, match in fuzzy_matches.items():
+        epg_name, score = match if match else (None, None)
+        matches[name] = {"tvg_id": epg_map.get(epg_name), "epg_name": epg_name, "score": score, "epg_hash": epg_hash}
+    tmp_path = f"{cache_path}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"matches": matches}, f, ensure_ascii=False)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        logger.warning(f"Could not write fuzzy match cache {cache_path}: {e}")
+
+def _iter_m3u_folder(m3u_folder):
     for m3u_file in glob.glob(f"{m3u_folder}/*.m3u"):
         logger.info(f"Parsing M3U file: {m3u_file}")
-        with open(m3u_file, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
-            if line.startswith("#EXTINF"):
-                attrs = {}
-                match = re.search(r'#EXTINF:-1\s+(.*?)\s*,\s*(.*)', line)
-                if match:
-                    attr_str, display_name = match.groups()
-                    for attr_match in re.finditer(r'(\w+?)="(.*?)"', attr_str):
-                        key, value = attr_match.groups()
-                        attrs[key] = value
-                    attrs['display_name'] = display_name.strip() # Original M3U display name
-
-                    # Normalize M3U display name for grouping and EPG lookup
-                    current_channel_normalized_name = normalize_name(attrs['display_name'])
-                    attrs['canonical_name'] = current_channel_normalized_name
-
-                    # Attempt to find tvg-id using normalized names
-                    tvg_id_from_epg = epg_map.get(current_channel_normalized_name)
-
-                    if not tvg_id_from_epg and normalized_epg_names_for_fuzz: # If no direct match, try fuzzy
-                        match_result = process.extractOne(
-                            current_channel_normalized_name,
-                            normalized_epg_names_for_fuzz,
-                            scorer=fuzz.WRatio,
-                            score_cutoff=FUZZY_MATCH_THRESHOLD
-                        )
-                        if match_result:
-                            best_match_norm_name, score, _ = match_result
-                            tvg_id_from_epg = epg_map.get(best_match_norm_name)
-                            logger.info(f"Fuzzy EPG match for M3U: '{attrs['display_name']}' (norm: '{current_channel_normalized_name}') -> EPG norm: '{best_match_norm_name}' (tvg-id: {tvg_id_from_epg}, score: {score})")
-
-                    if tvg_id_from_epg:
-                        attrs['tvg-id'] = tvg_id_from_epg # Prioritize EPG-matched ID
-                    elif not attrs.get('tvg-id'): # No tvg-id from M3U and no EPG match
-                        logger.warning(f"No tvg-id found for M3U channel: '{attrs['display_name']}' (norm: '{current_channel_normalized_name}') after EPG lookup.")
-
-                i += 1
-                if i < len(lines):
-                    url = lines[i].strip()
-                    attrs['url'] = url
-                    channel_entries.append(attrs)
-            i += 1
-    logger.info(f"Parsed {len(channel_entries)} channel entries from M3U files.")
-    return channel_entries
+        yield from iter_m3u_entries(iter_m3u_lines(m3u_file))
+
+def parse_m3u_files(m3u_folder="input/"):
+    """Generator over channel entries from all M3U files in m3u_folder, with canonical_name and EPG tvg-id resolved."""
+    # epg_map is now {normalized_epg_display_name: tvg_id}
+    epg_map = load_epg_map()
+    matcher = EpgMatcher(epg_map.keys(), FUZZY_MATCH_THRESHOLD)
+    epg_hash = epg_content_hash(epg_map)
+    # normalized M3U name -> (epg_name, score) or None, reused across entries, files and reloads
+    fuzzy_matches = load_fuzzy_match_cache(epg_hash)
+    new_fuzzy_match_count = 0
+    entry_count = 0
+
+    entries = _iter_m3u_folder(m3u_folder)
+    while True:
+        # Buffer a bounded batch so names without an exact EPG match can be fuzzy-matched together
+        batch = list(islice(entries, FUZZY_BATCH_SIZE))
+        if not batch:
+            break
+        for attrs in batch:
+            if 'display_name' in attrs:
+                # Normalize M3U display name for grouping and EPG lookup
+                attrs['canonical_name'] = normalize_name(attrs['display_name'])
+        if matcher.names:
+            unmatched = {
+                attrs['canonical_name'] for attrs in batch
+                if 'canonical_name' in attrs and attrs['canonical_name'] not in epg_map and attrs['canonical_name'] not in fuzzy_matches
+            }
+            fuzzy_matches.update(matcher.match_many(unmatched))
+            new_fuzzy_match_count += len(unmatched)
+
+        for attrs in batch:
+            if 'canonical_name' in attrs:
+                current_channel_normalized_name = attrs['canonical_name']
+
+                # Attempt to find tvg-id using normalized names
+                tvg_id_from_epg = epg_map.get(current_channel_normalized_name)
+
+                if not tvg_id_from_epg: # If no direct match, use the fuzzy match
+                    match_result = fuzzy_matches.get(current_channel_normalized_name)
+                    if match_result:
+                        best_match_norm_name, score = match_result
+                        tvg_id_from_epg = epg_map.get(best_match_norm_name)
+                        logger.info(f"Fuzzy EPG match for M3U: '{attrs['display_name']}' (norm: '{current_channel_normalized_name}') -> EPG norm: '{best_match_norm_name}' (tvg-id: {tvg_id_from_epg}, score: {score})")
+
+                if tvg_id_from_epg:
+                    attrs['tvg-id'] = tvg_id_from_epg # Prioritize EPG-matched ID
+                elif not attrs.get('tvg-id'): # No tvg-id from M3U and no EPG match
+                    logger.warning(f"No tvg-id found for M3U channel: '{attrs['display_name']}' (norm: '{current_channel_normalized_name}') after EPG lookup.")
+
+            entry_count += 1
+            yield attrs
+    logger.info(f"Parsed {entry_count} channel entries from M3U files ({new_fuzzy_match_count} name(s) newly fuzzy-matched against the EPG).")
+    if new_fuzzy_match_count:
+        save_fuzzy_match_cache(epg_hash, epg_map, fuzzy_matches)
 
 def group_channels(channel_entries):
     grouped = defaultdict(list)
     for entry in channel_entries:
-        norm_name = normalize_name(entry.get('display_name', ''))
+        # canonical_name was already computed by parse_m3u_files for every entry with a display name
+        norm_name = entry['canonical_name'] if 'canonical_name' in entry else normalize_name(entry.get('display_name', ''))
         grouped[norm_name].append(entry)
     return grouped
 
@@ -170,6 +577,76 @@ def generate_playlist(grouped_channels):
             playlist += f'{extinf}{channel["url"]}\n'
     return playlist
 
+def render_playlist(active_streams):
+    """Render {group_name: entry_dict} as M3U text. Channel numbers follow sorted group names."""
+    m3u_parts = ["#EXTM3U\n"]
+
+    # Sort by group_name (canonical_name) for consistent channel numbering
+    sorted_channel_groups = sorted(active_streams.items())
+
+    channel_number = 1
+    for group_name, entry in sorted_channel_groups: # group_name is the canonical_name
+        if not entry:
+            continue
+
+        current_tvg_id = entry.get("tvg-id", "")
+
+        # Determine the best possible display name for the channel
+        # 1. Start with the canonical_name (normalized name from parsing, should align with group_name)
+        name_for_display_output = entry.get('canonical_name', group_name)
+
+        # 2. If normalized name is empty, fall back to the original M3U display_name for this stream
+        if not name_for_display_output:
+            name_for_display_output = entry.get('display_name', '') # Original name from M3U
+
+        # 3. If still empty, fall back to its tvg-id if available
+        if not name_for_display_output:
+            name_for_display_output = current_tvg_id
+
+        # 4. Absolute fallback if all else fails (e.g., no tvg-id, display_name was empty/stripped)
+        if not name_for_display_output:
+            name_for_display_output = f"Unnamed Channel {channel_number}"
+
+        # Determine the tvg-name attribute value for the #EXTINF line
+        # Prioritize tvg-name from original M3U for this stream, then the determined name_for_display_output
+        final_tvg_name_attribute = entry.get("tvg-name") # Get original tvg-name from M3U attributes
+        if final_tvg_name_attribute is None or final_tvg_name_attribute == "": # If missing or explicitly empty
+            final_tvg_name_attribute = name_for_display_output
+
+        current_tvg_logo = entry.get("tvg-logo", "")
+        current_group_title = entry.get("group-title", "")
+
+        extinf_parts = [f'#EXTINF:-1 tvg-chno="{channel_number}"']
+        if current_tvg_id:
+            extinf_parts.append(f'tvg-id="{current_tvg_id}"')
+        extinf_parts.append(f'tvg-name="{final_tvg_name_attribute}"') # Always include tvg-name
+        if current_tvg_logo: # Only add if non-empty
+            extinf_parts.append(f'tvg-logo="{current_tvg_logo}"')
+        if current_group_title: # Only add if non-empty
+            extinf_parts.append(f'group-title="{current_group_title}"')
+
+        extinf = " ".join(extinf_parts) + f',{name_for_display_output}' # Use best determined name after comma
+        m3u_parts.append(f"{extinf}\n{entry['url']}\n")
+        channel_number += 1
+    return "".join(m3u_parts)
+
+def start_background_threads():
+    """
+    Start the health monitor and refresher threads. Threads don't survive a fork, so this must
+    run in the process that serves requests: gunicorn calls it from the post_worker_init hook
+    in gunicorn.conf.py (the app itself is --preload'ed in the master).
+    """
+    # Start automatic health monitor
+    monitor = checker.scheduled_monitor if MONITOR_MODE == "scheduled" else checker.background_monitor
+    threading.Thread(target=monitor, args=(MONITOR_INTERVAL,), daemon=True).start()
+
+    if PLAYLIST_MODE == "snapshot":
+        # Keep the active stream snapshot fresh so /playlist.m3u never probes inline
+        threading.Thread(target=checker.snapshot_refresher, args=(SNAPSHOT_REFRESH_INTERVAL,), daemon=True).start()
+
+    # Keep the rewritten EPG prebuilt so /epg.xml is served straight from disk
+    threading.Thread(target=epg_cache_refresher, args=(EPG_CACHE_CHECK_INTERVAL,), daemon=True).start()
+
 def create_app():
     global checker
     entries = parse_m3u_files("input/")
@@ -181,64 +658,36 @@ def create_app():
 
     checker = StreamChecker({"channels": grouped_channels})
 
-    # Start automatic health monitor
-    threading.Thread(target=checker.background_monitor, daemon=True).start()
-
     flask_app = Flask(__name__)
     
     @flask_app.route("/playlist.m3u")
     def serve_playlist():
-        m3u = "#EXTM3U\n"
-        active_streams = checker.get_active_streams() # {group_name: entry_dict}
-
-        # Sort by group_name (canonical_name) for consistent channel numbering
-        sorted_channel_groups = sorted(active_streams.items())
-
-        channel_number = 1
-        for group_name, entry in sorted_channel_groups: # group_name is the canonical_name
-            if not entry:
-                continue
-
-            current_tvg_id = entry.get("tvg-id", "")
-
-            # Determine the best possible display name for the channel
-            # 1. Start with the canonical_name (normalized name from parsing, should align with group_name)
-            name_for_display_output = entry.get('canonical_name', group_name)
-
-            # 2. If normalized name is empty, fall back to the original M3U display_name for this stream
-            if not name_for_display_output:
-                name_for_display_output = entry.get('display_name', '') # Original name from M3U
-
-            # 3. If still empty, fall back to its tvg-id if available
-            if not name_for_display_output:
-                name_for_display_output = current_tvg_id
-
-            # 4. Absolute fallback if all else fails (e.g., no tvg-id, display_name was empty/stripped)
-            if not name_for_display_output:
-                name_for_display_output = f"Unnamed Channel {channel_number}"
-
-            # Determine the tvg-name attribute value for the #EXTINF line
-            # Prioritize tvg-name from original M3U for this stream, then the determined name_for_display_output
-            final_tvg_name_attribute = entry.get("tvg-name") # Get original tvg-name from M3U attributes
-            if final_tvg_name_attribute is None or final_tvg_name_attribute == "": # If missing or explicitly empty
-                final_tvg_name_attribute = name_for_display_output
-
-            current_tvg_logo = entry.get("tvg-logo", "")
-            current_group_title = entry.get("group-title", "")
-
-            extinf_parts = [f'#EXTINF:-1 tvg-chno="{channel_number}"']
-            if current_tvg_id:
-                extinf_parts.append(f'tvg-id="{current_tvg_id}"')
-            extinf_parts.append(f'tvg-name="{final_tvg_name_attribute}"') # Always include tvg-name
-            if current_tvg_logo: # Only add if non-empty
-                extinf_parts.append(f'tvg-logo="{current_tvg_logo}"')
-            if current_group_title: # Only add if non-empty
-                extinf_parts.append(f'group-title="{current_group_title}"')
-
-            extinf = " ".join(extinf_parts) + f',{name_for_display_output}' # Use best determined name after comma
-            m3u += f"{extinf}\n{entry['url']}\n"
-            channel_number += 1
-        return Response(m3u, mimetype="application/x-mpegURL")
+        if PLAYLIST_MODE != "snapshot":
+            checker.get_active_streams() # Probe everything now; the sweep publishes a fresh snapshot
+        snapshot_version, snapshot_changed_at, active_streams = checker.get_snapshot(max_staleness=PLAYLIST_MAX_STALENESS)
+
+        # Only re-render when the active stream selection changed since the cached body was built
+        with _playlist_cache_lock:
+            if _playlist_cache["version"] != snapshot_version:
+                body = render_playlist(active_streams).encode("utf-8")
+                _playlist_cache.update({
+                    "version": snapshot_version,
+                    "body": body,
+                    "variants": compress_variants(body), # Compressed once per snapshot version, not per request
+                    "etag": hashlib.sha1(body).hexdigest(), # Content hash, so it stays valid across restarts
+                    "last_modified": datetime.fromtimestamp(snapshot_changed_at, tz=timezone.utc),
+                })
+            cached = dict(_playlist_cache)
+
+        encoding = negotiate_encoding(cached["variants"])
+        response = Response(cached["variants"][encoding] if encoding else cached["body"], mimetype="application/x-mpegURL")
+        response.set_etag(f'{cached["etag"]}-{encoding}' if encoding else cached["etag"]) # Each encoding is a distinct representation
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        if cached["variants"]:
+            response.vary.add("Accept-Encoding")
+        response.last_modified = cached["last_modified"]
+        return response.make_conditional(request) # 304 for matching If-None-Match / If-Modified-Since
 
     @flask_app.route("/failover/<channel>")
     def failover_channel(channel):
@@ -250,39 +699,51 @@ def create_app():
     def serve_modified_epg():
         """Serve modified EPG with normalized display names"""
         try:
-            tree = ET.parse("input/guide.xml")
-            root = tree.getroot()
-            
-            # Create mapping of tvg-id to canonical names
-            tvg_id_to_canonical_name_map = {}
-            if checker.config and "channels" in checker.config:
-                for entries_list in checker.config["channels"].values():
-                    for entry in entries_list:
-                        if 'tvg-id' in entry and 'canonical_name' in entry:
-                            # If multiple groups somehow map to the same tvg-id, last one wins.
-                            tvg_id_to_canonical_name_map[entry['tvg-id']] = entry['canonical_name']
-            
-            # Update display names in EPG
-            for channel_node in root.findall(".//channel"):
-                tvg_id = channel_node.get("id")
-                if tvg_id in tvg_id_to_canonical_name_map:
-                    for display_name_node in channel_node.findall("display-name"):
-                        display_name_node.text = tvg_id_to_canonical_name_map[tvg_id]
-            
-            # Return modified EPG
-            epg_data = ET.tostring(root, encoding='utf-8', method='xml')
-            return Response(epg_data, mimetype="application/xml")
-            
+            with _epg_cache_lock:
+                if _epg_cache["key"] is not None and not os.path.exists(_epg_cache["path"]):
+                    _epg_cache["key"] = None # Removed from under us (e.g. cache dir wiped): rebuild it
+            key = refresh_epg_cache("input/guide.xml") # Kicks off a rebuild if guide.xml or the channels changed
+            with _epg_cache_lock:
+                cached = dict(_epg_cache)
+
+            if cached["key"] is None:
+                # Nothing built yet: stream a rewrite directly while the cache is being built
+                epg_file = open("input/guide.xml", "rb") # Opened up front so a missing guide is still a 500
+                tvg_id_to_canonical_name_map, _ = current_epg_name_map()
+                keep_ids = set(tvg_id_to_canonical_name_map) if EPG_PRUNE else None
+                return Response(
+                    iter_modified_epg(epg_file, tvg_id_to_canonical_name_map, keep_ids, epg_window()),
+                    mimetype="application/xml",
+                )
+
+            # Serve the cached copy (the previous one while a rebuild for changed inputs is running)
+            encoding = negotiate_encoding(cached["variants"])
+            response = send_file(
+                cached["variants"][encoding] if encoding else cached["path"],
+                mimetype="application/xml",
+                etag=f'{cached["key"]}-{encoding}' if encoding else cached["key"], # Each encoding is a distinct representation
+                last_modified=cached["last_modified"],
+                conditional=True, # 304 for matching If-None-Match / If-Modified-Since
+            )
+            if encoding:
+                response.headers["Content-Encoding"] = encoding
+            if cached["variants"]:
+                response.vary.add("Accept-Encoding")
+            if cached["key"] != key:
+                logger.info("Serving previous EPG cache while it is rebuilt.")
+            return response
+
         except Exception as e:
             logger.error(f"EPG modification error: {e}")
             return Response("# Error processing EPG", status=500)
 
     return flask_app
 
-# Used by Gunicorn
+# Used by Gunicorn (background threads are started per worker, see gunicorn.conf.py)
 app = create_app()
 
 if __name__ == "__main__":
+    start_background_threads()
     # Start the M3U auto-reloader thread.
     threading.Thread(target=auto_reload_m3u, daemon=True).start()
     app.run(host="0.0.0.0", port=8000)
\ No newline at end of file
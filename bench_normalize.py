@@ -0,0 +1,49 @@
+"""
+Microbenchmark for normalizer.normalize_name.
+
+    python bench_normalize.py [count]
+
+Reports names/sec for the uncached normalizer, a cold cache (every name new) and a
+warm cache (names repeating, as on reloads and across M3U files).
+"""
+import random
+import sys
+import time
+
+from normalizer import normalize_name
+
+PREFIXES = ["", "", "UK: ", "US: ", "PT: ", "[VIP] "]
+BRANDS = ["BBC One", "Sky Sports Main Event", "CNN International", "Eurosport 2", "BT Sport 1", "Discovery Channel", "ESPN"]
+SUFFIXES = ["", " HD", " FHD", " 4K", " (backup)", " HD 1", " 1 2", " UK"]
+
+
+def make_names(count, seed=42):
+    rng = random.Random(seed)
+    return [
+        f"{rng.choice(PREFIXES)}{rng.choice(BRANDS)} {i}{rng.choice(SUFFIXES)}"
+        for i in range(count)
+    ]
+
+
+def bench(label, fn, names):
+    started = time.perf_counter()
+    for name in names:
+        fn(name)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<12} {len(names) / elapsed:>14,.0f} names/sec ({len(names)} names in {elapsed:.3f}s)")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    names = make_names(count)
+    repeated = names[:count // 100] * 100  # ~1% distinct names
+
+    bench("uncached", normalize_name.__wrapped__, names)
+    normalize_name.cache_clear()
+    bench("cold cache", normalize_name, names)
+    normalize_name.cache_clear()
+    bench("warm cache", normalize_name, repeated)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,8 +5,12 @@ set -e
 mkdir -p /app/logs
 chmod 755 /app/logs
 
+# Create EPG cache directory
+mkdir -p /app/cache/epg
+
 # Run with preload
-exec gunicorn --bind 0.0.0.0:8000 \
+exec gunicorn --config gunicorn.conf.py \
+     --bind 0.0.0.0:8000 \
      --workers 1 \
      --threads 2 \
      --log-level info \
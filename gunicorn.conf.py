@@ -0,0 +1,6 @@
+# Gunicorn loads the app in the master (--preload) and forks workers from it. Threads
+# started in the master are not copied into the workers, so start them once the worker is up.
+
+def post_worker_init(worker):
+    import app
+    app.start_background_threads()
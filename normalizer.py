@@ -0,0 +1,101 @@
+import json
+import logging
+import os
+import re
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Optional JSON rule file overriding DEFAULT_RULES key by key, e.g.
+#   {"strip_prefixes": ["uk:", "nl:"], "tags": ["hd", "fhd", "nl"], "replacements": {"&": "and"}}
+# strip_prefixes: removed once from the start of the lowercased name (after tags are removed)
+# tags: whole words removed anywhere in the name, with optional trailing digits ("hd" also strips "hd2")
+# replacements: literal substrings replaced right after lowercasing, longest key first
+NORMALIZE_RULES_PATH = os.environ.get("NORMALIZE_RULES_PATH", "input/normalize_rules.json")
+DEFAULT_RULES = {
+    "strip_prefixes": ["uk:", "us:", "ca:", "pt:", "es:", "tr:", "lb:"],
+    "tags": ["hd", "fhd", "uhd", "4k", "sd", "uk", "us", "ca", "au", "de", "pt", "fr"],
+    "replacements": {},
+}
+
+# Fixed steps, applied in this order by normalize_name around the rule-based ones
+BRACKETED_RE = re.compile(r'\s*\(.*?\)|\[.*?\]')  # Content within parentheses or brackets
+PUNCTUATION_RE = re.compile(r'[^\w\s]')
+WHITESPACE_RE = re.compile(r'\s+')
+# "<text> <digits> <digits> ..." -> "<text> <digits>": trailing numbers after another number are stream
+# indices, e.g. "bt sport 1 1" -> "bt sport 1". One pass of the lazy prefix is equivalent to repeatedly
+# stripping the last number while the name still ends in "<space><digits><space><digits>".
+TRAILING_INDEX_RE = re.compile(r'^(.*?\s\d+)(?:\s\d+)+$')
+
+def trie_pattern(words):
+    """
+    Regex alternation for a set of literal words, factored as a trie ("hd|hdr|fhd" ->
+    "(?:fhd|hd(?:r)?)") so matching cost grows with word length, not with the number of words.
+    Longer words win over their prefixes.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {} # End of word
+
+    def build(node):
+        alternatives = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not alternatives:
+            return ""
+        pattern = alternatives[0] if len(alternatives) == 1 else "(?:" + "|".join(alternatives) + ")"
+        if "" in node: # A word ends here, so the rest is optional
+            return f"(?:{pattern})?"
+        return pattern
+
+    return build(trie)
+
+def compile_rules(rules):
+    """Compile a rule dict into the regexes normalize_name applies."""
+    tags = [tag.lower() for tag in rules.get("tags", []) if tag]
+    prefixes = [prefix.lower() for prefix in rules.get("strip_prefixes", []) if prefix]
+    replacements = {key.lower(): value for key, value in rules.get("replacements", {}).items() if key}
+    return {
+        "tag_re": re.compile(r'\b' + trie_pattern(tags) + r'\d*\b') if tags else None,
+        "prefix_re": re.compile('^' + trie_pattern(prefixes)) if prefixes else None,
+        "replace_re": re.compile(trie_pattern(replacements)) if replacements else None,
+        "replacements": replacements,
+    }
+
+_compiled_rules = compile_rules(DEFAULT_RULES)
+
+def load_rules(rules_path=NORMALIZE_RULES_PATH):
+    """(Re)load normalization rules from rules_path (falling back to DEFAULT_RULES) and reset the memo."""
+    global _compiled_rules
+    rules = dict(DEFAULT_RULES)
+    try:
+        with open(rules_path, "r", encoding="utf-8") as f:
+            rules.update(json.load(f))
+        compiled_rules = compile_rules(rules)
+        logger.info(f"Loaded name normalization rules from {rules_path}: {len(rules['tags'])} tag(s), {len(rules['strip_prefixes'])} prefix(es), {len(rules['replacements'])} replacement(s).")
+    except FileNotFoundError:
+        compiled_rules = compile_rules(DEFAULT_RULES)
+    except Exception as e:
+        logger.error(f"Name normalization rules error in {rules_path}, using defaults: {e}")
+        compiled_rules = compile_rules(DEFAULT_RULES)
+    _compiled_rules = compiled_rules
+    normalize_name.cache_clear()
+
+@lru_cache(maxsize=65536)
+def normalize_name(name):
+    """Normalize channel names by removing resolution tags, region suffixes, punctuation, and excess spaces."""
+    rules = _compiled_rules
+    name = name.lower()
+    if rules["replace_re"]:
+        name = rules["replace_re"].sub(lambda match: rules["replacements"][match.group(0)], name)
+    name = BRACKETED_RE.sub('', name)
+    if rules["tag_re"]:
+        name = rules["tag_re"].sub('', name)
+    if rules["prefix_re"]:
+        name = rules["prefix_re"].sub('', name)
+    name = PUNCTUATION_RE.sub('', name)
+    name = WHITESPACE_RE.sub(' ', name).strip()
+    return TRAILING_INDEX_RE.sub(r'\1', name)
+
+load_rules()
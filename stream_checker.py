@@ -1,11 +1,500 @@
 import threading
 import time
+import os
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
 import logging
+import asyncio
+import heapq
+import random
+import re
 import concurrent.futures
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+from itertools import zip_longest
+from urllib.parse import urlsplit, urljoin
+
+try:
+    import aiohttp
+except ImportError: # Only needed for PROBE_BACKEND=async
+    aiohttp = None
 
 logger = logging.getLogger(__name__)
 
+# Probe connection pooling: one urllib3 pool per host, kept for up to PROBE_POOL_HOSTS hosts,
+# each holding up to PROBE_POOL_MAXSIZE keep-alive connections.
+PROBE_POOL_HOSTS = int(os.environ.get("PROBE_POOL_HOSTS", 64))
+PROBE_POOL_MAXSIZE = int(os.environ.get("PROBE_POOL_MAXSIZE", 10))
+# Sweep backend: "thread" probes with a pool of PROBE_MAX_WORKERS threads, "async" uses
+# aiohttp with at most ASYNC_PROBE_CONCURRENCY open probes (ASYNC_PROBE_PER_HOST per host).
+PROBE_BACKEND = os.environ.get("PROBE_BACKEND", "thread")
+PROBE_MAX_WORKERS = int(os.environ.get("PROBE_MAX_WORKERS", 10))
+ASYNC_PROBE_CONCURRENCY = int(os.environ.get("ASYNC_PROBE_CONCURRENCY", 500))
+ASYNC_PROBE_PER_HOST = int(os.environ.get("ASYNC_PROBE_PER_HOST", 20))
+# Per-host politeness for probes: at most PROBE_HOST_CONCURRENCY concurrent probes per host
+# (thread backend; the async backend uses ASYNC_PROBE_PER_HOST), and an optional token bucket
+# allowing PROBE_HOST_RATE probes/second with bursts of PROBE_HOST_BURST. The bucket is off by
+# default (rate <= 0): a sweep of N streams on one host takes at least N / PROBE_HOST_RATE seconds,
+# so only enable it for providers that rate-limit, with a rate that still fits the sweep interval.
+PROBE_HOST_CONCURRENCY = int(os.environ.get("PROBE_HOST_CONCURRENCY", 8))
+PROBE_HOST_RATE = float(os.environ.get("PROBE_HOST_RATE", 0))
+PROBE_HOST_BURST = int(os.environ.get("PROBE_HOST_BURST", 20))
+# Probe timeouts: connecting fails after PROBE_CONNECT_TIMEOUT seconds. The read timeout starts
+# at PROBE_READ_TIMEOUT and, once a host has PROBE_TIMEOUT_MIN_SAMPLES successful probes, adapts
+# to p99 of its recent latencies x PROBE_TIMEOUT_FACTOR, clamped to [PROBE_TIMEOUT_FLOOR, PROBE_READ_TIMEOUT].
+# A read timeout counts as a latency sample of at least the timeout and doubles the host's read
+# timeout (up to PROBE_READ_TIMEOUT) until successful probes show the host has sped up again.
+PROBE_CONNECT_TIMEOUT = float(os.environ.get("PROBE_CONNECT_TIMEOUT", 3))
+PROBE_READ_TIMEOUT = float(os.environ.get("PROBE_READ_TIMEOUT", 10))
+PROBE_TIMEOUT_FACTOR = float(os.environ.get("PROBE_TIMEOUT_FACTOR", 3))
+PROBE_TIMEOUT_FLOOR = float(os.environ.get("PROBE_TIMEOUT_FLOOR", 2))
+PROBE_TIMEOUT_MIN_SAMPLES = int(os.environ.get("PROBE_TIMEOUT_MIN_SAMPLES", 20))
+PROBE_LATENCY_WINDOW = 200 # Latency samples kept per host
+# How a probe talks to a stream:
+#   "range" - GET with "Range: bytes=0-0", read the first byte, close (default)
+#   "head"  - HEAD request, falling back to "range" if the provider rejects HEAD
+#   "read"  - GET and read up to PROBE_READ_BYTES of the body before closing
+#   "get"   - GET and close as soon as the status line arrives
+# Time-to-first-byte (or to headers for "head"/"get") is recorded in StreamChecker.last_ttfb.
+PROBE_STRATEGY = os.environ.get("PROBE_STRATEGY", "range")
+PROBE_READ_BYTES = int(os.environ.get("PROBE_READ_BYTES", 4096))
+PROBE_OK_STATUSES = (200, 206, 301, 302)
+# Optional HLS deep probe: for .m3u8 URLs that pass the cheap probe, follow the master playlist
+# to its lowest-bandwidth variant, fetch HLS_SEGMENT_BYTES of the newest segment and measure
+# throughput (recorded in StreamChecker.last_throughput). Results are cached per URL for
+# HLS_DEEP_PROBE_TTL seconds. HLS_MIN_THROUGHPUT (bytes/s, 0 = off) fails slow streams.
+HLS_DEEP_PROBE = os.environ.get("HLS_DEEP_PROBE", "false").lower() in ("1", "true", "yes")
+HLS_DEEP_PROBE_TTL = int(os.environ.get("HLS_DEEP_PROBE_TTL", 300))
+HLS_SEGMENT_BYTES = int(os.environ.get("HLS_SEGMENT_BYTES", 32768))
+HLS_MIN_THROUGHPUT = float(os.environ.get("HLS_MIN_THROUGHPUT", 0))
+HLS_PLAYLIST_MAX_BYTES = 1024 * 1024 # Refuse to buffer anything larger as a "playlist"
+# Per-URL health cache shared by sweeps, the monitor and failovers: results are reused for
+# HEALTH_TTL_OK seconds (healthy) or HEALTH_TTL_FAILED seconds (failed), at most HEALTH_CACHE_SIZE URLs.
+HEALTH_TTL_OK = float(os.environ.get("HEALTH_TTL_OK", 30))
+HEALTH_TTL_FAILED = float(os.environ.get("HEALTH_TTL_FAILED", 10))
+HEALTH_CACHE_SIZE = int(os.environ.get("HEALTH_CACHE_SIZE", 50000))
+# Scheduled monitor (scheduled_monitor): every URL gets its own probe interval. Consecutive
+# identical results double it up to SCHEDULER_MAX_INTERVAL, a change of state resets it to
+# SCHEDULER_MIN_INTERVAL, and currently selected streams never wait longer than the monitor interval.
+SCHEDULER_MIN_INTERVAL = float(os.environ.get("SCHEDULER_MIN_INTERVAL", 15))
+SCHEDULER_MAX_INTERVAL = float(os.environ.get("SCHEDULER_MAX_INTERVAL", 1800))
+SCHEDULER_BATCH_SIZE = int(os.environ.get("SCHEDULER_BATCH_SIZE", 200)) # Most URLs probed per scheduler tick
+# Warm standby: the monitors pre-verify up to STANDBY_LOOKAHEAD streams after each group's current
+# one and keep the first STANDBY_CANDIDATES that work, so failover can jump straight to a known-good
+# stream. STANDBY_CANDIDATES=0 disables this and failover just advances to the next stream.
+STANDBY_CANDIDATES = int(os.environ.get("STANDBY_CANDIDATES", 2))
+STANDBY_LOOKAHEAD = int(os.environ.get("STANDBY_LOOKAHEAD", 5))
+# Stream selection within a group: "ranked" picks the healthy stream with the best rolling
+# latency/throughput score, "ordered" the first healthy stream from the current index on (M3U order).
+# A ranked group only moves off a healthy current stream if the best candidate scores below
+# SELECTION_HYSTERESIS x the current score and is at least SELECTION_MIN_GAIN seconds better.
+STREAM_SELECTION = os.environ.get("STREAM_SELECTION", "ranked")
+SELECTION_HYSTERESIS = float(os.environ.get("SELECTION_HYSTERESIS", 0.7))
+SELECTION_MIN_GAIN = float(os.environ.get("SELECTION_MIN_GAIN", 0.1))
+STATS_EWMA_ALPHA = 0.3 # Weight of the newest sample in the rolling stream stats
+# A stream a group failed over from (via /failover or the monitor) is passed over by ranked selection
+# and standby ranking for FAILOVER_COOLDOWN seconds, unless no other stream in the group works.
+FAILOVER_COOLDOWN = float(os.environ.get("FAILOVER_COOLDOWN", 600))
+# Per-host circuit breaker: after CIRCUIT_FAILURE_THRESHOLD consecutive failed connections to a
+# host its remaining URLs are reported dead without probing for CIRCUIT_COOLDOWN seconds, then up
+# to CIRCUIT_HALF_OPEN_PROBES trial probes decide whether it closes again or stays open.
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_COOLDOWN = float(os.environ.get("CIRCUIT_COOLDOWN", 30))
+CIRCUIT_HALF_OPEN_PROBES = int(os.environ.get("CIRCUIT_HALF_OPEN_PROBES", 1))
+PROBE_HEADERS = {
+    # Using a common, recent User-Agent
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+}
+
+
+def _host_of(url):
+    """Origin key used for per-host limits (host:port as written in the URL)."""
+    try:
+        return urlsplit(url).netloc.lower()
+    except ValueError:
+        return ""
+
+
+def _is_hls_url(url):
+    return urlsplit(url).path.lower().endswith(".m3u8")
+
+
+def _parse_hls_playlist(text, base_url):
+    """
+    Parse an HLS playlist. Returns ("master", [(bandwidth, variant_url), ...]) for a master
+    playlist or ("media", [segment_url, ...]) for a media playlist, with absolute URLs.
+    """
+    variants = []
+    segments = []
+    pending_bandwidth = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("#EXT-X-STREAM-INF"):
+            bandwidth = re.search(r'BANDWIDTH=(\d+)', line)
+            pending_bandwidth = int(bandwidth.group(1)) if bandwidth else 0
+        elif line.startswith("#"):
+            continue
+        elif pending_bandwidth is not None:
+            variants.append((pending_bandwidth, urljoin(base_url, line)))
+            pending_bandwidth = None
+        else:
+            segments.append(urljoin(base_url, line))
+    if variants:
+        return "master", variants
+    return "media", segments
+
+
+class HostLimiter:
+    """Per-host concurrency cap (semaphore) and token-bucket rate limit for probes."""
+
+    def __init__(self, max_concurrent, rate, burst):
+        self.max_concurrent = max_concurrent
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._buckets = {} # host -> (tokens, last_refill); tokens go negative while callers queue
+
+    def reserve(self, host):
+        """Take a token for host and return how many seconds the caller must wait before probing."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            tokens, last_refill = self._buckets.get(host, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last_refill) * self.rate) - 1
+            self._buckets[host] = (tokens, now)
+        return 0.0 if tokens >= 0 else -tokens / self.rate
+
+    @contextmanager
+    def slot(self, host):
+        """Block until host has a free concurrency slot and a rate token."""
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = self._semaphores[host] = threading.BoundedSemaphore(self.max_concurrent)
+        with semaphore:
+            delay = self.reserve(host)
+            if delay:
+                time.sleep(delay)
+            yield
+
+
+class HostLatencyTracker:
+    """
+    Rolling window of probe latencies per host, used to derive adaptive read timeouts.
+    Timed-out probes are recorded as censored samples (latency >= the timeout) and back the
+    host's timeout off, so a host that slowed down is not locked out by its old, fast history.
+    """
+
+    def __init__(self, window, min_samples, factor, floor, ceiling):
+        self.window = window
+        self.min_samples = min_samples
+        self.factor = factor
+        self.floor = floor
+        self.ceiling = ceiling
+        self._lock = threading.Lock()
+        self._samples = {} # host -> deque of seconds
+        self._backoff = {} # host -> minimum read timeout after recent timeouts
+
+    def _append(self, host, seconds):
+        samples = self._samples.get(host)
+        if samples is None:
+            samples = self._samples[host] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def record(self, host, seconds):
+        with self._lock:
+            self._append(host, seconds)
+            backoff = self._backoff.get(host)
+            if backoff is not None: # Relax the back-off gradually rather than dropping straight back
+                if backoff / 2 <= self.floor:
+                    del self._backoff[host]
+                else:
+                    self._backoff[host] = backoff / 2
+
+    def record_timeout(self, host, timeout):
+        """A probe got no response within `timeout` seconds."""
+        with self._lock:
+            self._append(host, timeout)
+            self._backoff[host] = min(self.ceiling, max(self._backoff.get(host, 0.0), timeout * 2))
+
+    def read_timeout(self, host):
+        """p99 latency x factor for hosts with enough history, otherwise the configured ceiling."""
+        with self._lock:
+            samples = sorted(self._samples.get(host, ()))
+            backoff = self._backoff.get(host, 0.0)
+        if len(samples) < self.min_samples:
+            return self.ceiling
+        p99 = samples[int(0.99 * (len(samples) - 1))]
+        return max(backoff, self.floor, min(self.ceiling, p99 * self.factor))
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller runs the function and
+    every caller arriving while it is in flight waits for and shares its result (or exception).
+    Works across threads, including coroutines running in different threads' event loops.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {} # key -> {"done": Event, "result", "error", "waiters": [(loop, Future), ...]}
+
+    def _join(self, key):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                return call, False
+            call = self._calls[key] = {"done": threading.Event(), "result": None, "error": None, "waiters": []}
+            return call, True
+
+    def _finish(self, key, call):
+        with self._lock:
+            del self._calls[key]
+            call["done"].set()
+            waiters, call["waiters"] = call["waiters"], []
+        for loop, future in waiters: # Coroutine followers, woken inside their own event loops
+            try:
+                loop.call_soon_threadsafe(self._wake, future)
+            except RuntimeError: # That loop has already closed
+                pass
+
+    @staticmethod
+    def _wake(future):
+        if not future.done():
+            future.set_result(None)
+
+    @staticmethod
+    def _shared_result(call):
+        if call["error"] is not None:
+            raise call["error"]
+        return call["result"]
+
+    def do(self, key, fn, *args):
+        call, leader = self._join(key)
+        if not leader:
+            call["done"].wait()
+            return self._shared_result(call)
+        try:
+            call["result"] = fn(*args)
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            self._finish(key, call)
+
+    async def do_async(self, key, coro_fn, *args):
+        call, leader = self._join(key)
+        if not leader:
+            # Wait in the event loop rather than parking an executor thread on the Event: the
+            # default executor is small and shared with the deep probes leaders may still need.
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            with self._lock:
+                if call["done"].is_set():
+                    future.set_result(None) # Finished between _join and here
+                else:
+                    call["waiters"].append((loop, future))
+            await future
+            return self._shared_result(call)
+        try:
+            call["result"] = await coro_fn(*args)
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            self._finish(key, call)
+
+
+class HostCircuitBreaker:
+    """
+    Closed / open / half-open circuit breaker per host. Only failures to get any HTTP
+    response (connection errors, timeouts before the response headers) count; an error
+    status, or a body that stalls after the headers, means the host is up.
+    """
+
+    def __init__(self, failure_threshold, cooldown, half_open_probes):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.half_open_probes = half_open_probes
+        self._lock = threading.Lock()
+        self._hosts = {} # host -> {"state", "failures", "opened_at", "trials"}
+
+    def allow(self, host):
+        """Whether a probe to host may be sent now."""
+        with self._lock:
+            breaker = self._hosts.get(host)
+            if breaker is None or breaker["state"] == "closed":
+                return True
+            if breaker["state"] == "open":
+                if time.monotonic() - breaker["opened_at"] < self.cooldown:
+                    return False
+                breaker["state"] = "half-open"
+                breaker["trials"] = 0
+                logger.info(f"[Circuit] Host {host} half-open, sending trial probe(s).")
+            if breaker["trials"] >= self.half_open_probes:
+                return False
+            breaker["trials"] += 1
+            return True
+
+    def is_open(self, host):
+        """Whether host is currently being skipped; unlike allow(), never uses up a half-open trial."""
+        with self._lock:
+            breaker = self._hosts.get(host)
+            return breaker is not None and breaker["state"] == "open" and time.monotonic() - breaker["opened_at"] < self.cooldown
+
+    def record_success(self, host):
+        with self._lock:
+            breaker = self._hosts.get(host)
+            if breaker is None:
+                return
+            if breaker["state"] != "closed":
+                logger.info(f"[Circuit] Host {host} recovered, circuit closed.")
+            del self._hosts[host]
+
+    def record_failure(self, host):
+        with self._lock:
+            breaker = self._hosts.setdefault(host, {"state": "closed", "failures": 0, "opened_at": 0.0, "trials": 0})
+            breaker["failures"] += 1
+            if breaker["state"] == "half-open" or (breaker["state"] == "closed" and breaker["failures"] >= self.failure_threshold):
+                breaker["state"] = "open"
+                breaker["opened_at"] = time.monotonic()
+                logger.warning(f"[Circuit] Host {host} unreachable after {breaker['failures']} failed probe(s); skipping its streams for {self.cooldown:.0f}s.")
+
+
+class HealthCache:
+    """LRU-bounded cache of the latest probe result per URL with separate TTLs for healthy and failed results."""
+
+    def __init__(self, ttl_ok, ttl_failed, max_size):
+        self.ttl_ok = ttl_ok
+        self.ttl_failed = ttl_failed
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # url -> {"ok", "latency", "checked_at"}
+
+    def get(self, url, max_age=None):
+        """Returns the cached result for url if still within its TTL (or max_age, if given), otherwise None."""
+        with self._lock:
+            result = self._entries.get(url)
+            if result is None:
+                return None
+            ttl = max_age if max_age is not None else (self.ttl_ok if result["ok"] else self.ttl_failed)
+            if time.monotonic() - result["checked_at"] > ttl:
+                return None
+            self._entries.move_to_end(url)
+            return result
+
+    def put(self, url, ok, latency=None):
+        with self._lock:
+            self._entries[url] = {"ok": ok, "latency": latency, "checked_at": time.monotonic()}
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class HealthScheduler:
+    """
+    Min-heap of (next_due, priority, seq, url) deciding when each stream URL is probed next.
+    Heap items are invalidated lazily: one is only acted on if it still matches the URL's state.
+    """
+
+    def __init__(self, base_interval, min_interval, max_interval):
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._lock = threading.Lock()
+        self._heap = []
+        self._seq = 0
+        self._state = {} # url -> {"due", "interval", "ok", "selected"}
+
+    def _push(self, url, state, due):
+        state["due"] = due
+        self._seq += 1
+        heapq.heappush(self._heap, (due, 0 if state["selected"] else 1, self._seq, url))
+
+    def sync(self, urls, selected_urls):
+        """Track exactly `urls`; streams in `selected_urls` are due within base_interval."""
+        now = time.monotonic()
+        with self._lock:
+            for url in list(self._state):
+                if url not in urls:
+                    del self._state[url] # Its heap items become stale
+            for url in urls:
+                selected = url in selected_urls
+                state = self._state.get(url)
+                if state is None:
+                    state = self._state[url] = {"interval": self.min_interval, "ok": None, "selected": selected}
+                    # Selected streams are verified right away; the rest are spread over one interval
+                    self._push(url, state, now if selected else now + random.uniform(0, self.base_interval))
+                elif selected and not state["selected"]:
+                    state["selected"] = True
+                    state["interval"] = min(state["interval"], self.base_interval)
+                    self._push(url, state, now) # Newly selected (e.g. after a failover): verify it now
+                else:
+                    state["selected"] = selected
+
+    def pop_due(self, limit):
+        """Pop up to `limit` URLs whose next check is due, selected streams first on ties."""
+        now = time.monotonic()
+        due_urls = []
+        with self._lock:
+            while self._heap and len(due_urls) < limit:
+                due, _, _, url = self._heap[0]
+                state = self._state.get(url)
+                if state is None or state["due"] != due:
+                    heapq.heappop(self._heap) # Stale item
+                    continue
+                if due > now:
+                    break
+                heapq.heappop(self._heap)
+                state["due"] = None # Checked out until report()
+                due_urls.append(url)
+        return due_urls
+
+    def seconds_until_next(self):
+        with self._lock:
+            while self._heap:
+                due, _, _, url = self._heap[0]
+                state = self._state.get(url)
+                if state is None or state["due"] != due:
+                    heapq.heappop(self._heap)
+                    continue
+                return max(0.0, due - time.monotonic())
+        return None
+
+    def result_max_age(self, url):
+        """
+        How old url's last probe result may be while still trusted: its current interval plus
+        one base_interval of slack for a backlogged scheduler. None if url isn't tracked or probed yet.
+        """
+        with self._lock:
+            state = self._state.get(url)
+            if state is None or state["ok"] is None:
+                return None
+            return state["interval"] + self.base_interval
+
+    def report(self, url, ok):
+        """Reschedule url after a probe: back off while stable, check again soon after a change."""
+        with self._lock:
+            state = self._state.get(url)
+            if state is None:
+                return
+            if state["ok"] is None or state["ok"] != ok:
+                interval = self.min_interval # New or flapping stream
+            else:
+                interval = min(state["interval"] * 2, self.max_interval)
+            if state["selected"]:
+                interval = min(interval, self.base_interval)
+            state["ok"] = ok
+            state["interval"] = interval
+            self._push(url, state, time.monotonic() + interval)
+
 
 class StreamChecker:
     def __init__(self, config):
@@ -13,8 +502,49 @@ class StreamChecker:
         self.stream_groups = {}
         self.current_index = {}
         self.lock = threading.Lock()
+        # Last published result of get_active_streams(), served by the playlist route
+        # without probing. snapshot_built_at is monotonic (0.0 = never built).
+        # snapshot_version only changes when the selected streams change, so callers
+        # can cache anything derived from the snapshot per version.
+        self.active_snapshot = {}
+        self.snapshot_built_at = 0.0
+        self.snapshot_version = 0
+        self.snapshot_changed_at = time.time() # Wall clock, used for Last-Modified
+        self.session = self._build_session()
+        self.health_cache = HealthCache(HEALTH_TTL_OK, HEALTH_TTL_FAILED, HEALTH_CACHE_SIZE)
+        self.last_ttfb = {} # url -> seconds to first byte of the last successful probe
+        self.last_throughput = {} # url -> bytes/second of the last HLS deep probe segment fetch
+        self.hls_probe_cache = {} # url -> (monotonic checked_at, passed)
+        self.stream_stats = {} # url -> {"latency": ewma seconds, "throughput": ewma bytes/s} from successful probes
+        self.standby = {} # group_name -> [url, ...] of pre-verified failover candidates, best first
+        self.failover_cooldown = {} # url -> monotonic time until which ranked selection avoids it
+        self.last_monitor_cycle_duration = None # Seconds taken by the latest background_monitor cycle
+        self.scheduler = None # HealthScheduler while scheduled_monitor runs; sweeps then reuse its results
+        self.host_limiter = HostLimiter(PROBE_HOST_CONCURRENCY, PROBE_HOST_RATE, PROBE_HOST_BURST)
+        self.inflight = SingleFlight() # Coalesces concurrent sweeps and concurrent probes of one URL
+        self.circuit_breaker = HostCircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_COOLDOWN, CIRCUIT_HALF_OPEN_PROBES)
+        self.host_latency = HostLatencyTracker(
+            PROBE_LATENCY_WINDOW, PROBE_TIMEOUT_MIN_SAMPLES, PROBE_TIMEOUT_FACTOR, PROBE_TIMEOUT_FLOOR, PROBE_READ_TIMEOUT,
+        )
+        self.probe_backend = PROBE_BACKEND
+        if self.probe_backend == "async" and aiohttp is None:
+            logger.warning("PROBE_BACKEND=async requires aiohttp, which is not installed. Falling back to thread-based probing.")
+            self.probe_backend = "thread"
         self.load_stream_groups()
 
+    def _build_session(self):
+        """Shared session for all probes so repeated checks against a provider reuse keep-alive connections."""
+        session = requests.Session()
+        session.headers.update(PROBE_HEADERS)
+        adapter = HTTPAdapter(
+            pool_connections=PROBE_POOL_HOSTS,
+            pool_maxsize=PROBE_POOL_MAXSIZE,
+            max_retries=0, # A failed probe is an answer, not something to retry
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
     def load_stream_groups(self):
         with self.lock:
             for name, urls in self.config["channels"].items():
@@ -24,10 +554,14 @@ class StreamChecker:
     def get_active_streams(self):
         """
         Returns a dictionary of {channel_group_name: working_entry_dict}.
-        For each channel group, it tries to find the first working stream
-        starting from its current_index and cycling through if necessary.
+        For each channel group, it checks every stream and picks a working one
+        (see STREAM_SELECTION), preferring the stream at its current_index.
         If no working stream is found for a group, that group is omitted.
+        Concurrent callers share a single sweep and its result.
         """
+        return self.inflight.do("sweep", self._sweep_active_streams)
+
+    def _sweep_active_streams(self):
         with self.lock:
             # Step 1: Safely copy data needed for checks.
             # This minimizes lock holding time during network operations.
@@ -53,36 +587,23 @@ class StreamChecker:
             return {}
 
         active_working_streams = {}
-        max_workers_for_check = 10  # Adjust as needed
 
         # Step 2: Perform stream checks in parallel for all streams across all groups
-        # future_to_info: maps a future to (group_name, original_stream_index_in_group_entries)
-        future_to_info = {}
+        # all_entries is flat; group_slices maps group_name to its [start, end) range in it
+        all_entries = []
+        group_slices = {}
+        for group_name, group_data in groups_to_process.items():
+            group_slices[group_name] = (len(all_entries), len(all_entries) + group_data["num_entries"])
+            all_entries.extend(group_data["entries"])
+        all_results = self.check_streams(all_entries)
         # group_check_results: { group_name: [False, True, ...] }
         group_check_results = {
-            gn: [False] * g_data["num_entries"] for gn, g_data in groups_to_process.items()
+            gn: all_results[start:end] for gn, (start, end) in group_slices.items()
         }
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers_for_check) as executor:
-            for group_name, group_data in groups_to_process.items():
-                for original_idx, entry in enumerate(group_data["entries"]):
-                    future = executor.submit(self._is_stream_working, entry)
-                    future_to_info[future] = (group_name, original_idx)
-            
-            for future in concurrent.futures.as_completed(future_to_info):
-                group_name, original_idx = future_to_info[future]
-                entry_for_log = groups_to_process[group_name]["entries"][original_idx]
-                try:
-                    is_working = future.result()
-                    group_check_results[group_name][original_idx] = is_working
-                    if is_working:
-                        logger.debug(f"Parallel check: Stream {entry_for_log.get('url')} for group '{group_name}' (idx {original_idx}) is working.")
-                except Exception as exc:
-                    logger.error(f"Exception during parallel check for stream {entry_for_log.get('url', 'N/A')} in group {group_name}: {exc}")
-                    # group_check_results[group_name][original_idx] remains False (default)
-
         # Step 3: Select the best stream for each group and prepare updates for current_index
         new_current_indices = {}
+        new_standbys = {}
         for group_name, group_data in groups_to_process.items():
             entries = group_data["entries"]
             start_index = group_data["start_index"]
@@ -90,44 +611,283 @@ class StreamChecker:
             results_for_group = group_check_results[group_name]
 
             chosen_stream_entry = None
-            chosen_stream_original_index = -1
+            chosen_stream_original_index = self._select_index(entries, results_for_group, start_index)
+            if chosen_stream_original_index >= 0:
+                chosen_stream_entry = entries[chosen_stream_original_index]
 
-            for i in range(num_entries):
-                idx_to_try = (start_index + i) % num_entries
-                if results_for_group[idx_to_try]:
-                    chosen_stream_entry = entries[idx_to_try]
-                    chosen_stream_original_index = idx_to_try
-                    break
-            
             if chosen_stream_entry:
                 logger.info(f"Selected working stream for group '{group_name}': {chosen_stream_entry.get('url')} (original index {chosen_stream_original_index}) after parallel checks.")
                 active_working_streams[group_name] = chosen_stream_entry
                 new_current_indices[group_name] = chosen_stream_original_index
+                # Working streams after the chosen one become its warm standbys
+                new_standbys[group_name] = self._rank_urls([
+                    entries[(chosen_stream_original_index + k) % num_entries]['url'] for k in range(1, num_entries)
+                    if results_for_group[(chosen_stream_original_index + k) % num_entries]
+                ])[:STANDBY_CANDIDATES]
             else:
                 logger.warning(f"No working streams found for channel group '{group_name}' after checking all {num_entries} streams in parallel. Group will be omitted from playlist.")
 
         # Step 4: Atomically update self.current_index for groups where a working stream was found
         if new_current_indices:
-            # Adjust max_workers as needed. More workers can speed up checks for groups
-            # with many streams, but too many can also lead to resource issues or
-            # getting rate-limited. 10 is a reasonable default.
             with self.lock:
                 for group_name, new_idx in new_current_indices.items():
                     # Ensure group still exists in case of concurrent update_config
                     if group_name in self.stream_groups: # Check if group still exists
                          self.current_index[group_name] = new_idx
-        
+                         self.standby[group_name] = new_standbys[group_name]
+
+        self._publish_snapshot(active_working_streams)
         return active_working_streams
 
+    def _select_index(self, entries, results, start_index):
+        """
+        Pick the index of the stream a group should use given per-entry health results,
+        or -1 if none works. See STREAM_SELECTION for the two policies.
+        """
+        num_entries = len(entries)
+        if STREAM_SELECTION != "ranked":
+            for i in range(num_entries):
+                idx_to_try = (start_index + i) % num_entries
+                if results[idx_to_try]:
+                    return idx_to_try
+            return -1
+
+        healthy = [i for i in range(num_entries) if results[i]]
+        if not healthy:
+            return -1
+        # Don't switch back to a stream just failed over from while anything else works
+        healthy = [i for i in healthy if not self._in_failover_cooldown(entries[i]['url'])] or healthy
+        # Ties keep M3U order starting from the current stream
+        best = min(healthy, key=lambda i: (self.stream_score(entries[i]['url']), (i - start_index) % num_entries))
+        if results[start_index] and best != start_index:
+            current_score = self.stream_score(entries[start_index]['url'])
+            best_score = self.stream_score(entries[best]['url'])
+            if best_score > current_score * SELECTION_HYSTERESIS or current_score - best_score < SELECTION_MIN_GAIN:
+                return start_index # Not enough of an improvement to justify switching
+        return best
+
+    def stream_score(self, url):
+        """
+        Expected seconds to start playback from url (lower is better): rolling time to first
+        byte plus, when an HLS deep probe measured it, the time to fetch HLS_SEGMENT_BYTES.
+        Streams without stats score as slow as the read timeout.
+        """
+        stats = self.stream_stats.get(url)
+        if not stats or stats.get("latency") is None:
+            return PROBE_READ_TIMEOUT
+        score = stats["latency"]
+        if stats.get("throughput"):
+            score += HLS_SEGMENT_BYTES / stats["throughput"]
+        return score
+
+    def _in_failover_cooldown(self, url):
+        until = self.failover_cooldown.get(url)
+        return until is not None and time.monotonic() < until
+
+    def _rank_urls(self, urls):
+        """Sort urls best score first (stable, so equal scores keep their order), failover cooldowns last."""
+        if STREAM_SELECTION != "ranked":
+            return urls
+        return sorted(urls, key=lambda url: (self._in_failover_cooldown(url), self.stream_score(url)))
+
+    def _update_stats(self, url, key, value):
+        with self.lock:
+            stats = self.stream_stats.setdefault(url, {"latency": None, "throughput": None})
+            previous = stats[key]
+            stats[key] = value if previous is None else previous + STATS_EWMA_ALPHA * (value - previous)
+
+    def _record_success(self, url, ttfb):
+        self.last_ttfb[url] = ttfb
+        self.host_latency.record(_host_of(url), ttfb)
+        self._update_stats(url, "latency", ttfb)
+
+    def check_streams(self, entries, use_cache=True):
+        """
+        Probe many streams concurrently with the configured backend.
+        Returns a list of booleans aligned with entries (entry dicts or raw URLs).
+        URLs with a fresh health cache result are not probed again (unless use_cache
+        is False), and each distinct URL is probed at most once per call. While
+        scheduled_monitor runs, a URL it tracks counts as fresh for as long as the
+        scheduler would wait before rechecking it, so sweeps don't undo its back-off.
+        """
+        if not entries:
+            return []
+        urls = [entry['url'] if isinstance(entry, dict) else entry for entry in entries]
+        results = {}
+        urls_to_probe = []
+        for url in urls:
+            if url in results:
+                continue
+            cached = None
+            if use_cache:
+                scheduler = self.scheduler
+                cached = self.health_cache.get(url, scheduler.result_max_age(url) if scheduler else None)
+            if cached is not None:
+                results[url] = cached["ok"]
+            else:
+                results[url] = False
+                urls_to_probe.append(url)
+
+        if urls_to_probe:
+            if self.probe_backend == "async":
+                probed = asyncio.run(self._check_streams_async(urls_to_probe))
+            else:
+                probed = self._check_streams_threaded(urls_to_probe)
+            for url, is_working in zip(urls_to_probe, probed):
+                results[url] = is_working
+                self.health_cache.put(url, is_working, self.last_ttfb.get(url) if is_working else None)
+            logger.debug(f"check_streams: probed {len(urls_to_probe)} of {len(urls)} stream(s), the rest served from the health cache.")
+        return [results[url] for url in urls]
+
+    def _check_streams_threaded(self, entries):
+        # Adjust PROBE_MAX_WORKERS as needed. More workers can speed up sweeps, but too
+        # many can also lead to resource issues or getting rate-limited.
+        results = [False] * len(entries)
+        # Submit round-robin across hosts so workers blocked on one host's limits don't
+        # starve probes for other hosts, which proceed in parallel.
+        indices_by_host = defaultdict(list)
+        for i, entry in enumerate(entries):
+            indices_by_host[_host_of(entry['url'] if isinstance(entry, dict) else entry)].append(i)
+        submit_order = [i for batch in zip_longest(*indices_by_host.values()) for i in batch if i is not None]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=PROBE_MAX_WORKERS) as executor:
+            future_to_index = {
+                executor.submit(self.inflight.do, ("probe", entries[i]), self._is_stream_working, entries[i]): i
+                for i in submit_order
+            }
+            for future in concurrent.futures.as_completed(future_to_index):
+                i = future_to_index[future]
+                url = entries[i]['url'] if isinstance(entries[i], dict) else entries[i]
+                try:
+                    results[i] = future.result()
+                    if results[i]:
+                        logger.debug(f"Parallel check: Stream {url} is working.")
+                except Exception as exc:
+                    logger.error(f"Exception during parallel check for stream {url}: {exc}")
+                    # results[i] remains False (default)
+        return results
+
+    async def _check_streams_async(self, entries):
+        # The connector enforces both the global and the per-host connection limits;
+        # probes beyond them wait for a free connection without a timeout of their own.
+        connector = aiohttp.TCPConnector(
+            limit=ASYNC_PROBE_CONCURRENCY,
+            limit_per_host=ASYNC_PROBE_PER_HOST,
+            ttl_dns_cache=300,
+        )
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=PROBE_CONNECT_TIMEOUT, sock_read=PROBE_READ_TIMEOUT)
+        # Probes queue per host here rather than inside the connector, so each one consults the
+        # circuit breaker only once it can actually be sent (see _is_stream_working_async).
+        host_slots = defaultdict(lambda: asyncio.Semaphore(ASYNC_PROBE_PER_HOST))
+        async with aiohttp.ClientSession(connector=connector, headers=PROBE_HEADERS, timeout=timeout) as session:
+            return await asyncio.gather(*(
+                self.inflight.do_async(("probe", entry), self._is_stream_working_async, session, entry, host_slots) for entry in entries
+            ))
+
+    def _publish_snapshot(self, active_working_streams):
+        """Replace the active stream snapshot with the result of a full sweep."""
+        with self.lock:
+            self._set_snapshot({
+                group_name: entry for group_name, entry in active_working_streams.items()
+                if group_name in self.stream_groups # Drop groups removed by a concurrent update_config
+            })
+            self.snapshot_built_at = time.monotonic()
+
+    def _set_snapshot(self, new_snapshot):
+        """Swap in a new snapshot, bumping the version only if the selection changed. Caller holds self.lock."""
+        if new_snapshot != self.active_snapshot:
+            self.snapshot_version += 1
+            self.snapshot_changed_at = time.time()
+        self.active_snapshot = new_snapshot
+
+    def get_snapshot(self, max_staleness=600):
+        """
+        Returns (snapshot_version, snapshot_changed_at, {channel_group_name: working_entry_dict})
+        for the last published sweep without probing.
+        A full sweep is only run inline if no snapshot exists yet or the current one is
+        older than max_staleness seconds (i.e. the background refresher has fallen behind).
+        """
+        with self.lock:
+            built_at = self.snapshot_built_at
+        if not built_at or time.monotonic() - built_at > max_staleness:
+            logger.info(f"[Snapshot] Snapshot missing or older than {max_staleness}s, refreshing inline...")
+            self.get_active_streams()
+        with self.lock:
+            return self.snapshot_version, self.snapshot_changed_at, dict(self.active_snapshot)
+
+    def snapshot_refresher(self, interval=120):
+        """Periodically re-runs the full sweep so get_snapshot() stays fresh."""
+        while True:
+            started = time.monotonic()
+            try:
+                active = self.get_active_streams()
+                logger.info(f"[Snapshot] Refreshed active stream snapshot: {len(active)} group(s) in {time.monotonic() - started:.1f}s.")
+            except Exception as e:
+                logger.error(f"[Snapshot] Refresh failed: {e}")
+            time.sleep(interval)
+
+    def refresh_standbys(self):
+        """
+        Pre-verify up to STANDBY_LOOKAHEAD streams following each group's current stream and keep
+        the first STANDBY_CANDIDATES that work as that group's warm standbys.
+        """
+        if STANDBY_CANDIDATES <= 0:
+            return
+        candidates = {} # group_name -> [url, ...] in failover order
+        with self.lock:
+            for group_name, entries in self.stream_groups.items():
+                if len(entries) < 2:
+                    continue
+                current = self.current_index.get(group_name, 0)
+                candidates[group_name] = [
+                    entries[(current + k) % len(entries)]['url'] for k in range(1, min(len(entries), STANDBY_LOOKAHEAD + 1))
+                ]
+        if not candidates:
+            return
+
+        flat_urls = [url for urls in candidates.values() for url in urls]
+        working = dict(zip(flat_urls, self.check_streams(flat_urls)))
+        with self.lock:
+            for group_name, urls in candidates.items():
+                if group_name in self.stream_groups:
+                    self.standby[group_name] = self._rank_urls([url for url in urls if working[url]])[:STANDBY_CANDIDATES]
+        logger.debug(f"[Standby] Refreshed warm standbys for {len(candidates)} group(s).")
+
     def mark_stream_failed(self, channel):
         with self.lock:
             if channel not in self.stream_groups:
                 return
+            entries = self.stream_groups[channel]
             current = self.current_index.get(channel, 0)
-            total = len(self.stream_groups[channel])
+            total = len(entries)
+            if 0 <= current < total: # Remember the failure so sweeps don't re-select it while the result is fresh
+                self.health_cache.put(entries[current]['url'], False)
+                # ...and keep ranked selection off it for longer, even once it probes healthy again
+                now = time.monotonic()
+                self.failover_cooldown = {url: until for url, until in self.failover_cooldown.items() if until > now}
+                self.failover_cooldown[entries[current]['url']] = now + FAILOVER_COOLDOWN
             if total > 0: # Avoid modulo by zero if a group becomes empty
-                self.current_index[channel] = (current + 1) % total # Advance to next stream
-                logger.info(f"[FAILOVER] {channel} → Switched to index {self.current_index[channel]}")
+                # Prefer the first warm standby. Standbys were verified when last refreshed, which can be
+                # longer ago than the health cache TTL (a monitor interval, or a scheduler back-off), so
+                # one is only passed over if a newer probe result, however old, says it has failed since.
+                new_index = None
+                for url in self.standby.get(channel, []):
+                    latest = self.health_cache.get(url, max_age=float("inf"))
+                    idx = next((i for i, entry in enumerate(entries) if entry['url'] == url), None)
+                    if idx is not None and idx != current and (latest is None or latest["ok"]):
+                        new_index = idx
+                        break
+                via = "warm standby"
+                if new_index is None:
+                    new_index = (current + 1) % total # Advance to next stream
+                    via = "next stream, no verified standby"
+                self.current_index[channel] = new_index
+                self.standby[channel] = [url for url in self.standby.get(channel, []) if url != entries[new_index]['url']]
+                if channel in self.active_snapshot: # Point the snapshot at the new stream until the next sweep verifies it
+                    new_snapshot = dict(self.active_snapshot)
+                    new_snapshot[channel] = entries[new_index]
+                    self._set_snapshot(new_snapshot)
+                logger.info(f"[FAILOVER] {channel} → Switched to index {new_index} ({via})")
             else:
                 logger.warning(f"[FAILOVER] Attempted to failover channel {channel}, but it has no streams.")
 
@@ -148,11 +908,28 @@ class StreamChecker:
                     self.current_index[group_name] = 0 # Default to 0 for new or changed/emptied groups
             
             self.stream_groups = new_stream_groups
+            self.standby = {group_name: urls for group_name, urls in self.standby.items() if group_name in new_stream_groups}
+            live_urls = {entry['url'] for entries_list in new_stream_groups.values() for entry in entries_list}
+            self.stream_stats = {url: stats for url, stats in self.stream_stats.items() if url in live_urls}
+            # Provider URLs often carry rotating tokens, so per-URL probe data would otherwise grow every reload
+            self.last_ttfb = {url: ttfb for url, ttfb in self.last_ttfb.items() if url in live_urls}
+            self.last_throughput = {url: throughput for url, throughput in self.last_throughput.items() if url in live_urls}
+            self.hls_probe_cache = {url: cached for url, cached in self.hls_probe_cache.items() if url in live_urls}
+            # Drop snapshot entries for groups that no longer exist; the rest are re-verified on the next sweep
+            self._set_snapshot({
+                group_name: entry for group_name, entry in self.active_snapshot.items()
+                if group_name in new_stream_groups
+            })
             logger.info("StreamChecker configuration updated.")
 
     def background_monitor(self, interval=60):
-        """Periodically checks if current streams are working."""
+        """
+        Periodically checks if current streams are working. Checks within a cycle run
+        concurrently through check_streams(), and cycles start every `interval` seconds
+        measured from the start of the previous cycle (immediately if it overran).
+        """
         while True:
+            cycle_started = time.monotonic()
             logger.info("[Monitor] Starting background check of default streams...")
             
             streams_to_check_in_monitor = {}
@@ -166,31 +943,264 @@ class StreamChecker:
                         idx = 0
                     streams_to_check_in_monitor[channel_group_name] = entries[idx]
 
-            for channel, entry in streams_to_check_in_monitor.items():
-                if not self._is_stream_working(entry):
+            channels = list(streams_to_check_in_monitor)
+            results = self.check_streams([streams_to_check_in_monitor[channel] for channel in channels])
+            for channel, is_working in zip(channels, results):
+                if not is_working:
+                    entry = streams_to_check_in_monitor[channel]
                     logger.warning(f"[Monitor] Default stream for {channel} failed (URL: {entry.get('url')}). Advancing index via mark_stream_failed...")
                     self.mark_stream_failed(channel)
-            time.sleep(interval)
+            self.refresh_standbys()
+
+            self.last_monitor_cycle_duration = time.monotonic() - cycle_started
+            failed_count = results.count(False)
+            if self.last_monitor_cycle_duration > interval:
+                logger.warning(f"[Monitor] Cycle checked {len(channels)} stream(s) ({failed_count} failed) in {self.last_monitor_cycle_duration:.1f}s, longer than the {interval}s interval.")
+            else:
+                logger.info(f"[Monitor] Cycle checked {len(channels)} stream(s) ({failed_count} failed) in {self.last_monitor_cycle_duration:.1f}s.")
+            time.sleep(max(0.0, cycle_started + interval - time.monotonic()))
+
+    def scheduled_monitor(self, interval=60):
+        """
+        Alternative to background_monitor that probes each stream URL when it is due according
+        to a HealthScheduler instead of sweeping every group each interval. Stable streams back
+        off up to SCHEDULER_MAX_INTERVAL, flapping ones are rechecked after SCHEDULER_MIN_INTERVAL,
+        and each group's current stream is checked at least every `interval` seconds.
+        """
+        scheduler = self.scheduler = HealthScheduler(interval, min(SCHEDULER_MIN_INTERVAL, interval), max(SCHEDULER_MAX_INTERVAL, interval))
+        next_standby_refresh = 0.0
+        while True:
+            if time.monotonic() >= next_standby_refresh:
+                self.refresh_standbys() # Mostly served from the health cache the scheduler keeps warm
+                next_standby_refresh = time.monotonic() + interval
+
+            with self.lock:
+                all_urls = {entry['url'] for entries in self.stream_groups.values() for entry in entries}
+                selected = {} # url -> [groups currently using it]
+                for group_name, entries in self.stream_groups.items():
+                    if entries:
+                        idx = self.current_index.get(group_name, 0)
+                        selected.setdefault(entries[idx if idx < len(entries) else 0]['url'], []).append(group_name)
+            scheduler.sync(all_urls, selected)
+
+            due_urls = scheduler.pop_due(SCHEDULER_BATCH_SIZE)
+            if not due_urls:
+                wait = scheduler.seconds_until_next()
+                time.sleep(1.0 if wait is None else min(wait, 1.0)) # Re-sync at least every second
+                continue
+
+            results = self.check_streams(due_urls, use_cache=False)
+            for url, is_working in zip(due_urls, results):
+                scheduler.report(url, is_working)
+                if not is_working:
+                    for channel in selected.get(url, []):
+                        logger.warning(f"[Monitor] Default stream for {channel} failed (URL: {url}). Advancing index via mark_stream_failed...")
+                        self.mark_stream_failed(channel)
+            logger.debug(f"[Monitor] Scheduled check of {len(due_urls)} stream(s), {results.count(False)} failed.")
 
     def _is_stream_working(self, entry):
         """Check if a stream URL is working (accepts either entry dict or raw URL)"""
+        url = entry['url'] if isinstance(entry, dict) else entry
+        host = _host_of(url)
+        if not self.circuit_breaker.allow(host):
+            logger.debug(f"Stream check skipped for URL {url}: circuit open for host {host}")
+            return False
+        answered = threading.Event() # Set once the host has sent response headers
         try:
-            url = entry['url'] if isinstance(entry, dict) else entry
-            headers = {
-                # Using a common, recent User-Agent
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-            }
-            # Increased timeout to 10 seconds
-            response = requests.get(url, headers=headers, timeout=10, stream=True)
-            
-            if response.status_code in [200, 301, 302]:
+            timeout = self._timeout_for(url)
+            with self.host_limiter.slot(host):
+                status, ttfb = self._probe(url, timeout, on_response=lambda: self._host_answered(host, answered))
+                if status in PROBE_OK_STATUSES and HLS_DEEP_PROBE and _is_hls_url(url):
+                    if not self._deep_probe_hls(url):
+                        return False
+            if status in PROBE_OK_STATUSES:
+                self._record_success(url, ttfb)
+                return True
+            else:
+                logger.debug(f"Stream check for URL {url} returned non-OK status: {status}")
+                return False
+        except (requests.exceptions.Timeout, urllib3.exceptions.ReadTimeoutError) as e:
+            if answered.is_set():
+                logger.debug(f"Stream check for URL {url}: headers received, but the body stalled past {timeout[1]:.1f}s")
+                return False
+            logger.debug(f"Stream check timed out for URL {url} (connect {timeout[0]:.1f}s / read {timeout[1]:.1f}s)")
+            if not isinstance(e, requests.exceptions.ConnectTimeout):
+                self.host_latency.record_timeout(host, timeout[1])
+            self.circuit_breaker.record_failure(host)
+            return False
+        except Exception as e:
+            logger.debug(f"Stream check failed for URL {url} with exception: {str(e)}")
+            if not answered.is_set():
+                self.circuit_breaker.record_failure(host)
+            return False
+
+    def _host_answered(self, host, answered):
+        """
+        on_response callback for _probe/_probe_async: the host sent response headers, so it is up
+        (closing its circuit) even if this channel's body then stalls, which says nothing about the host.
+        """
+        if not answered.is_set():
+            answered.set()
+            self.circuit_breaker.record_success(host) # The host answered, whatever the status
+
+    def _timeout_for(self, url):
+        """(connect, read) timeouts for a probe, with the read timeout adapted to the host's latency."""
+        return PROBE_CONNECT_TIMEOUT, self.host_latency.read_timeout(_host_of(url))
+
+    def _probe(self, url, timeout, on_response=None):
+        """
+        Issue one probe using PROBE_STRATEGY and return (status_code, time_to_first_byte).
+        Responses are closed before returning so no provider connection slot is held; a
+        fully read response (HEAD, 206 of one byte) also goes back to the pool for reuse.
+        A 200 with no body under the "read" strategy is reported as status None.
+        on_response, if given, is called as soon as a response's headers have arrived.
+        """
+        strategy = PROBE_STRATEGY
+        started = time.monotonic()
+        if strategy == "head":
+            with self.session.head(url, timeout=timeout, allow_redirects=True) as response:
+                if on_response is not None:
+                    on_response()
+                if response.status_code not in (405, 501):
+                    return response.status_code, time.monotonic() - started
+            # Provider rejects HEAD; fall back to a one-byte ranged GET
+            strategy = "range"
+            started = time.monotonic()
+
+        headers = {"Range": "bytes=0-0"} if strategy == "range" else None
+        with self.session.get(url, headers=headers, timeout=timeout, stream=True) as response:
+            if on_response is not None:
+                on_response()
+            if strategy == "get" or response.status_code not in PROBE_OK_STATUSES:
+                return response.status_code, time.monotonic() - started
+            first_byte = response.raw.read(1)
+            ttfb = time.monotonic() - started
+            if strategy == "read":
+                if not first_byte:
+                    return None, ttfb
+                response.raw.read(PROBE_READ_BYTES - 1)
+            return response.status_code, ttfb
+
+    def _deep_probe_hls(self, url):
+        """
+        Validate that an HLS stream is actually serving media: resolve the master playlist to
+        its lowest-bandwidth variant, then fetch the start of the newest segment and measure
+        throughput. Results are cached per URL for HLS_DEEP_PROBE_TTL seconds.
+        """
+        cached = self.hls_probe_cache.get(url)
+        if cached and time.monotonic() - cached[0] < HLS_DEEP_PROBE_TTL:
+            return cached[1]
+
+        passed = False
+        try:
+            playlist_url = url
+            for _ in range(3): # Master -> media, tolerating one extra level of nesting
+                kind, uris = _parse_hls_playlist(self._fetch_playlist(playlist_url), playlist_url)
+                if kind == "media":
+                    break
+                playlist_url = min(uris)[1] # Lowest bandwidth variant is the cheapest to sample
+            if kind != "media" or not uris:
+                logger.debug(f"HLS deep probe for {url}: no media segments found")
+            else:
+                segment_url = uris[-1] # Newest segment in a live window
+                started = time.monotonic()
+                with self.session.get(segment_url, headers={"Range": f"bytes=0-{HLS_SEGMENT_BYTES - 1}"}, timeout=self._timeout_for(segment_url), stream=True) as response:
+                    data = response.raw.read(HLS_SEGMENT_BYTES) if response.status_code in (200, 206) else b""
+                elapsed = max(time.monotonic() - started, 1e-6)
+                throughput = len(data) / elapsed
+                self.last_throughput[url] = throughput
+                if data:
+                    self._update_stats(url, "throughput", throughput)
+                passed = bool(data) and throughput >= HLS_MIN_THROUGHPUT
+                logger.debug(f"HLS deep probe for {url}: {len(data)} bytes of {segment_url} at {throughput / 1024:.0f} KiB/s")
+        except Exception as e:
+            logger.debug(f"HLS deep probe failed for URL {url} with exception: {str(e)}")
+
+        self.hls_probe_cache[url] = (time.monotonic(), passed)
+        return passed
+
+    def _fetch_playlist(self, url):
+        with self.session.get(url, timeout=self._timeout_for(url), stream=True) as response:
+            if response.status_code not in PROBE_OK_STATUSES:
+                raise ValueError(f"playlist {url} returned status {response.status_code}")
+            body = response.raw.read(HLS_PLAYLIST_MAX_BYTES, decode_content=True)
+        return body.decode("utf-8", errors="replace")
+
+    async def _is_stream_working_async(self, session, entry, host_slots):
+        """
+        aiohttp counterpart of _is_stream_working, used by the async sweep backend.
+        All probes of a sweep start at once, so the circuit breaker is consulted after waiting
+        for the host's slot and rate token: probes queued behind a host that just tripped are skipped.
+        """
+        url = entry['url'] if isinstance(entry, dict) else entry
+        host = _host_of(url)
+        async with host_slots[host]:
+            if self.circuit_breaker.is_open(host): # Don't spend a rate token on a probe that won't be sent
+                logger.debug(f"Stream check skipped for URL {url}: circuit open for host {host}")
+                return False
+            delay = self.host_limiter.reserve(host)
+            if delay:
+                await asyncio.sleep(delay)
+            if not self.circuit_breaker.allow(host):
+                logger.debug(f"Stream check skipped for URL {url}: circuit open for host {host}")
+                return False
+            return await self._probe_and_record_async(session, url, host)
+
+    async def _probe_and_record_async(self, session, url, host):
+        answered = threading.Event() # Set once the host has sent response headers
+        try:
+            timeout = self._timeout_for(url)
+            status, ttfb = await self._probe_async(
+                session, url, aiohttp.ClientTimeout(total=None, sock_connect=timeout[0], sock_read=timeout[1]),
+                on_response=lambda: self._host_answered(host, answered),
+            )
+            if status in PROBE_OK_STATUSES and HLS_DEEP_PROBE and _is_hls_url(url):
+                if not await asyncio.to_thread(self._deep_probe_hls, url):
+                    return False
+            if status in PROBE_OK_STATUSES:
+                self._record_success(url, ttfb)
                 return True
             else:
-                logger.debug(f"Stream check for URL {url} returned non-OK status: {response.status_code}")
+                logger.debug(f"Stream check for URL {url} returned non-OK status: {status}")
+                return False
+        except asyncio.TimeoutError as e:
+            if answered.is_set():
+                logger.debug(f"Stream check for URL {url}: headers received, but the body stalled past {timeout[1]:.1f}s")
                 return False
-        except requests.exceptions.Timeout:
-            logger.debug(f"Stream check timed out for URL {url} (10s)")
+            logger.debug(f"Stream check timed out for URL {url} (connect {timeout[0]:.1f}s / read {timeout[1]:.1f}s)")
+            if not isinstance(e, getattr(aiohttp, "ConnectionTimeoutError", ())): # Only set on aiohttp >= 3.10
+                self.host_latency.record_timeout(host, timeout[1])
+            self.circuit_breaker.record_failure(host)
             return False
         except Exception as e:
             logger.debug(f"Stream check failed for URL {url} with exception: {str(e)}")
+            if not answered.is_set():
+                self.circuit_breaker.record_failure(host)
             return False
+
+    async def _probe_async(self, session, url, timeout, on_response=None):
+        """aiohttp counterpart of _probe."""
+        strategy = PROBE_STRATEGY
+        started = time.monotonic()
+        if strategy == "head":
+            async with session.head(url, allow_redirects=True, timeout=timeout) as response:
+                if on_response is not None:
+                    on_response()
+                if response.status not in (405, 501):
+                    return response.status, time.monotonic() - started
+            strategy = "range"
+            started = time.monotonic()
+
+        headers = {"Range": "bytes=0-0"} if strategy == "range" else None
+        async with session.get(url, headers=headers, timeout=timeout) as response:
+            if on_response is not None:
+                on_response()
+            if strategy == "get" or response.status not in PROBE_OK_STATUSES:
+                return response.status, time.monotonic() - started
+            first_byte = await response.content.read(1)
+            ttfb = time.monotonic() - started
+            if strategy == "read":
+                if not first_byte:
+                    return None, ttfb
+                await response.content.read(PROBE_READ_BYTES - 1)
+            return response.status, ttfb